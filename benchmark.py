@@ -0,0 +1,465 @@
+"""
+Benchmarks for the Database Viewer and Exporter.
+
+Run with:
+    python benchmark.py                # micro-benchmarks and the pipeline suite
+    python benchmark.py --suite micro  # per-cell micro-benchmarks only
+    python benchmark.py --suite pipeline --rows 100000 --width 8 --chains aes,rsa+aes
+    python benchmark.py --suite startup   # import time of main.py and each backend's driver
+
+The pipeline suite generates synthetic SQLite databases and JSON Lines files with cells
+encrypted under each chain, then times the fetch, decrypt and export stages separately
+(each in its own process, so peak RSS is per stage) and the end-to-end fetch_data modes.
+The startup suite times, in fresh interpreters, importing main.py and loading each backend.
+"""
+import os
+import io
+import sys
+import csv
+import json
+import time
+import zlib
+import base64
+import sqlite3
+import logging
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from contextlib import redirect_stdout
+from tabulate import tabulate
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.backends import default_backend
+from main import (
+    decrypt_combined, Decryptor, PlannedDecryptor, DecryptionEngine, RowBatch,
+    iter_batches, read_json_records, export_batches, export_data, fetch_data, close_pools, optional_module,
+    DECRYPT_CACHE_SIZE, ENVELOPE_MAGIC, ENVELOPE_ZLIB, BATCH_SIZE, BACKEND_DRIVERS
+)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Encryption chains of the synthetic cells
+CHAINS = ('aes', '3des', 'rsa+aes', 'zlib')
+
+# Decryption modes compared in the decrypt and end-to-end stages
+MODES = ('baseline', 'streaming', 'parallel', 'cache')
+
+# Run in a fresh interpreter per backend: prints the seconds spent importing main.py and
+# loading the backend's driver, and the import error of a driver that is not installed
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+error = None
+try:
+    if sys.argv[1] in main.BACKEND_DRIVERS:
+        main.load_driver(sys.argv[1])
+except ImportError as e:
+    error = str(e)
+print(json.dumps([imported - start, time.perf_counter() - imported, error]))
+"""
+
+def encrypt_aes(data, key):
+    """
+    Encrypts data the way decrypt_aes expects it: a 16-byte IV followed by AES-CFB ciphertext.
+    """
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend()).encryptor()
+    return iv + encryptor.update(data) + encryptor.finalize()
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+def encrypt_envelope(data, data_key, wrapped_key, compress=True):
+    """
+    Builds an envelope cell: the RSA-wrapped data key followed by the AES-encrypted payload.
+    """
+    flags = ENVELOPE_ZLIB if compress else 0
+    payload = encrypt_aes(zlib.compress(data) if compress else data, data_key)
+    return ENVELOPE_MAGIC + bytes([flags]) + len(wrapped_key).to_bytes(2, 'big') + wrapped_key + payload
+
+def encrypt_3des(data, key):
+    """
+    Encrypts data the way decrypt_3des expects it: an 8-byte IV followed by 3DES-CFB ciphertext.
+    """
+    iv = os.urandom(8)
+    encryptor = Cipher(algorithms.TripleDES(key), modes.CFB(iv), backend=default_backend()).encryptor()
+    return iv + encryptor.update(data) + encryptor.finalize()
+
+def make_cells(count, key):
+    """
+    Builds zlib-compressed, AES-encrypted cells.
+    """
+    return [encrypt_aes(zlib.compress(f"value-{i}".encode()), key) for i in range(count)]
+
+def time_per_cell(func, cells):
+    """
+    Returns the average time per cell in microseconds.
+    """
+    start = time.perf_counter()
+    for cell in cells:
+        func(cell)
+    return (time.perf_counter() - start) / len(cells) * 1e6
+
+def bench_decryptor(cells=20000):
+    """
+    Compares per-cell overhead of decrypt_combined with a session Decryptor.
+    """
+    key = os.urandom(32)
+    data = make_cells(cells, key)
+    decryptor = Decryptor(key)
+
+    before = time_per_cell(lambda cell: decrypt_combined(cell, key), data)
+    after = time_per_cell(decryptor.decrypt, data)
+    print(f"decrypt_combined:  {before:8.2f} us/cell")
+    print(f"Decryptor.decrypt: {after:8.2f} us/cell ({before / after:.2f}x)")
+
+def bench_column_plans(cells=2000):
+    """
+    Compares full probing of every cell with per-column chain plans. An RSA key is loaded
+    but the column is AES-only, so full probing pays a failed RSA attempt per cell.
+    """
+    key = os.urandom(32)
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    data = make_cells(cells, key)
+    decryptor = Decryptor(key, private_key)
+    planned = PlannedDecryptor(key, private_key)
+
+    before = time_per_cell(decryptor.decrypt, data)
+    after = time_per_cell(lambda cell: planned.decrypt_cell(0, cell), data)
+    print(f"full probing:      {before:8.2f} us/cell")
+    print(f"column plan:       {after:8.2f} us/cell ({before / after:.2f}x)")
+
+def bench_decrypt_cache(cells=20000, distinct=50):
+    """
+    Compares decrypting a low-cardinality column with and without the decrypted-value cache.
+    """
+    key = os.urandom(32)
+    values = make_cells(distinct, key)
+    data = [values[i % distinct] for i in range(cells)]
+    decryptor = Decryptor(key)
+    cached = Decryptor(key, cache_size=DECRYPT_CACHE_SIZE)
+
+    before = time_per_cell(lambda cell: decryptor.decrypt_cell(0, cell), data)
+    after = time_per_cell(lambda cell: cached.decrypt_cell(0, cell), data)
+    stats = cached.cache.stats()
+    print(f"no cache:          {before:8.2f} us/cell")
+    print(f"value cache:       {after:8.2f} us/cell ({before / after:.2f}x, {stats['hit_rate']:.1%} hits)")
+
+def bench_envelope(cells=2000, data_keys=10):
+    """
+    Compares RSA-encrypting every cell with envelope cells sharing a few RSA-wrapped data keys.
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    public_key = private_key.public_key()
+    rsa_cells = [public_key.encrypt(f"value-{i}".encode(), OAEP) for i in range(cells)]
+    keys = [os.urandom(32) for _ in range(data_keys)]
+    wrapped = [public_key.encrypt(data_key, OAEP) for data_key in keys]
+    envelope_cells = [encrypt_envelope(f"value-{i}".encode(), keys[i % data_keys], wrapped[i % data_keys]) for i in range(cells)]
+    decryptor = Decryptor(os.urandom(32), private_key)
+
+    before = time_per_cell(decryptor.decrypt_rsa, rsa_cells)
+    after = time_per_cell(decryptor.decrypt_envelope, envelope_cells)
+    print(f"RSA per cell:      {before:8.2f} us/cell")
+    print(f"envelope:          {after:8.2f} us/cell ({before / after:.2f}x)")
+
+def chain_material(chain, private_key):
+    """
+    Returns (session key, private key, encrypt function) for a chain.
+    The zlib chain has no symmetric key, so only decompression applies to it.
+    A 3DES key is also a valid AES-192 key, so the probing chain unwraps AES, DES (3DES)
+    and 3DES in turn; 3DES cells are built in that order.
+    """
+    if chain == 'aes':
+        key = os.urandom(32)
+        return key, None, lambda data: encrypt_aes(zlib.compress(data), key)
+    if chain == '3des':
+        key = os.urandom(24)
+        return key, None, lambda data: encrypt_aes(encrypt_3des(encrypt_3des(data, key), key), key)
+    if chain == 'rsa+aes':
+        data_key = os.urandom(32)
+        wrapped_key = private_key.public_key().encrypt(data_key, OAEP)
+        return os.urandom(32), private_key, lambda data: encrypt_envelope(data, data_key, wrapped_key)
+    if chain == 'zlib':
+        return None, None, zlib.compress
+    raise ValueError(f"Unknown chain: {chain}")
+
+def synthetic_value(column, i):
+    return f"c{column}-value-{i:08d}"
+
+def check_rows(rows):
+    """
+    Raises ValueError unless every cell after the id decrypted back to its synthetic value.
+    """
+    for row in rows:
+        for column, cell in enumerate(row[1:]):
+            if not isinstance(cell, str) or not cell.startswith(f"c{column}-value-") or len(cell) != len(synthetic_value(column, 0)):
+                raise ValueError(f"Row {row[0]} column c{column} did not decrypt: {cell!r:.40}")
+
+def check_csv(path, width):
+    """
+    Runs check_rows on an exported CSV file.
+    """
+    with open(path, newline='') as f:
+        check_rows([row['id']] + [row[f"c{column}"] for column in range(width)] for row in csv.DictReader(f))
+
+def synthetic_rows(rows, width, distinct, encrypt):
+    """
+    Yields (id, cell, ...) rows with `width` encrypted cells. Cells are drawn from `distinct`
+    ciphertexts per column (0 encrypts every cell separately).
+    """
+    pools = [[encrypt(synthetic_value(column, i).encode()) for i in range(distinct)] for column in range(width)] if distinct else None
+    for i in range(rows):
+        if pools:
+            yield (i + 1,) + tuple(pool[i % distinct] for pool in pools)
+        else:
+            yield (i + 1,) + tuple(encrypt(synthetic_value(column, i).encode()) for column in range(width))
+
+def generate_sqlite(path, rows, width, distinct, encrypt):
+    """
+    Writes a synthetic table `bench` with an integer id and `width` encrypted BLOB columns.
+    Returns the total size of the encrypted cells in bytes.
+    """
+    columns = ', '.join(f"c{column} BLOB" for column in range(width))
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE bench (id INTEGER PRIMARY KEY, {columns})")
+    total = 0
+    placeholders = ', '.join('?' * (width + 1))
+    batch = []
+    for row in synthetic_rows(rows, width, distinct, encrypt):
+        total += sum(len(cell) for cell in row[1:])
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            conn.executemany(f"INSERT INTO bench VALUES ({placeholders})", batch)
+            batch = []
+    if batch:
+        conn.executemany(f"INSERT INTO bench VALUES ({placeholders})", batch)
+    conn.commit()
+    conn.close()
+    return total
+
+def generate_json(path, rows, width, distinct, encrypt):
+    """
+    Writes a synthetic JSON Lines file with base64-encoded encrypted fields.
+    Returns the file size in bytes.
+    """
+    with open(path, 'w') as f:
+        for row in synthetic_rows(rows, width, distinct, encrypt):
+            record = {'id': row[0]}
+            record.update((f"c{column}", base64.b64encode(cell).decode()) for column, cell in enumerate(row[1:]))
+            f.write(json.dumps(record) + '\n')
+    return os.path.getsize(path)
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None if unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _stage_process(stage, args, results):
+    logging.disable(logging.CRITICAL)
+    try:
+        with redirect_stdout(io.StringIO()):
+            rows, size, seconds = stage(*args)
+        results.put((rows, size, seconds, peak_rss(), None))
+    except Exception as e:
+        results.put((0, 0, 0.0, peak_rss(), f"{type(e).__name__}: {e}"))
+
+def run_stage(stage, *args):
+    """
+    Runs a stage function returning (rows, bytes, seconds) in a fresh forked process,
+    so the reported peak RSS belongs to that stage alone. Falls back to running it inline.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        start_rss = peak_rss()
+        with redirect_stdout(io.StringIO()):
+            rows, size, seconds = stage(*args)
+        return rows, size, seconds, peak_rss() if start_rss is None else max(peak_rss(), start_rss), None
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=_stage_process, args=(stage, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def load_rows(source, path, width):
+    """
+    Loads all rows of a synthetic source as lists of cells (JSON fields base64-decoded).
+    """
+    if source == 'sqlite':
+        conn = sqlite3.connect(path)
+        rows = conn.execute("SELECT * FROM bench").fetchall()
+        conn.close()
+        return rows
+    fields = [f"c{column}" for column in range(width)]
+    return [[record['id']] + [base64.b64decode(record[field]) for field in fields] for record in read_json_records(path)]
+
+def stage_fetch(source, path, width):
+    start = time.perf_counter()
+    rows = 0
+    if source == 'sqlite':
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM bench")
+        for batch in iter_batches(cursor):
+            rows += len(batch)
+        conn.close()
+    else:
+        for _ in read_json_records(path):
+            rows += 1
+    return rows, None, time.perf_counter() - start
+
+def stage_decrypt(source, path, width, mode, key, private_key, workers):
+    data = load_rows(source, path, width)
+    # Every decrypted batch is checked, which costs little next to the decryption itself
+    start = time.perf_counter()
+    if mode == 'baseline':
+        for row in data:
+            check_rows([[decrypt_combined(cell, key, private_key) if isinstance(cell, bytes) else cell for cell in row]])
+    elif mode == 'parallel':
+        with DecryptionEngine(Decryptor(key, private_key), workers) as engine:
+            for batch in engine.decrypt_stream(data[i:i + BATCH_SIZE] for i in range(0, len(data), BATCH_SIZE)):
+                check_rows(batch.rows())
+    else:
+        decryptor = Decryptor(key, private_key, DECRYPT_CACHE_SIZE if mode == 'cache' else 0)
+        for i in range(0, len(data), BATCH_SIZE):
+            check_rows(RowBatch.from_rows(data[i:i + BATCH_SIZE], decryptor).rows())
+    return len(data), None, time.perf_counter() - start
+
+def stage_export(source, path, width, export_format, key, private_key, output):
+    decryptor = Decryptor(key, private_key)
+    data = load_rows(source, path, width)
+    batches = [RowBatch.from_rows(data[i:i + BATCH_SIZE], decryptor) for i in range(0, len(data), BATCH_SIZE)]
+    for batch in batches:
+        check_rows(batch.rows())
+    columns = ['id'] + [f"c{column}" for column in range(width)]
+    start = time.perf_counter()
+    export_batches(iter(batches), columns, export_format, output)
+    seconds = time.perf_counter() - start
+    return len(data), os.path.getsize(output), seconds
+
+def stage_end_to_end(source, path, width, mode, key, private_key, workers, output):
+    options = {'key': key, 'private_key': private_key, 'export': 'csv', 'output': output, 'preview_rows': 0}
+    if mode == 'parallel':
+        options['workers'] = workers
+    elif mode == 'cache':
+        options['decrypt_cache'] = True
+    start = time.perf_counter()
+    if mode == 'baseline':
+        # Pre-streaming behaviour: fetch everything, decrypt cell by cell, then export
+        data = load_rows(source, path, width)
+        rows = [[decrypt_combined(cell, key, private_key) if isinstance(cell, bytes) else cell for cell in row] for row in data]
+        export_data(rows, ['id'] + [f"c{column}" for column in range(width)], 'csv', output)
+        count = len(rows)
+    elif source == 'sqlite':
+        count = fetch_data('sqlite', database=path, table='bench', **options)
+        close_pools()
+    else:
+        count = fetch_data('json', file=path, encrypted_fields=[f"c{column}" for column in range(width)], **options)
+    seconds = time.perf_counter() - start
+    check_csv(output, width)
+    return count, os.path.getsize(output), seconds
+
+def bench_pipeline(rows=20000, width=4, distinct=1000, chains=CHAINS, sources=('sqlite', 'json'), workers=4, workdir=None):
+    """
+    Benchmarks the fetch, decrypt and export stages and end-to-end fetch_data on synthetic data.
+    Returns the result rows; MB/sec is based on the encrypted input for fetch and decrypt,
+    and on the written file for export.
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for chain in chains:
+            key, chain_private_key, encrypt = chain_material(chain, private_key)
+            # decrypt_combined predates envelope cells, so there is no baseline for them
+            modes = [mode for mode in MODES if mode != 'baseline' or chain != 'rsa+aes']
+            for source in sources:
+                path = os.path.join(tmp, f"{chain.replace('+', '_')}.{'db' if source == 'sqlite' else 'jsonl'}")
+                generate = generate_sqlite if source == 'sqlite' else generate_json
+                input_bytes = generate(path, rows, width, distinct, encrypt)
+                stages = [('fetch', stage_fetch, (source, path, width))]
+                stages += [(f"decrypt/{mode}", stage_decrypt, (source, path, width, mode, key, chain_private_key, workers)) for mode in modes]
+                formats = ['csv', 'jsonl'] + (['parquet'] if optional_module('pyarrow') is not None else [])
+                stages += [(f"export/{fmt}", stage_export, (source, path, width, fmt, key, chain_private_key, os.path.join(tmp, f"out.{fmt}"))) for fmt in formats]
+                stages += [(f"fetch_data/{mode}", stage_end_to_end, (source, path, width, mode, key, chain_private_key, workers, os.path.join(tmp, 'e2e.csv'))) for mode in modes]
+                for name, stage, args in stages:
+                    count, size, seconds, rss, error = run_stage(stage, *args)
+                    size = input_bytes if size is None or name.startswith('fetch_data') else size
+                    results.append([
+                        chain, source, name, count,
+                        f"{seconds:.3f}",
+                        f"{count / seconds:.0f}" if seconds else '-',
+                        f"{size / seconds / 1e6:.2f}" if seconds else '-',
+                        f"{rss / 1e6:.1f}" if rss else '-',
+                        error or ''
+                    ])
+    print(tabulate(results, headers=['chain', 'source', 'stage', 'rows', 'seconds', 'rows/sec', 'MB/sec', 'peak RSS MB', 'error'], tablefmt="pretty"))
+    return results
+
+def bench_startup(backends=None, repeat=5):
+    """
+    Times the startup of each backend in fresh interpreters: importing main.py, then loading
+    the backend's driver. Reports the best of `repeat` runs, and the whole process wall time
+    (interpreter start included) for comparison with a bare interpreter.
+    """
+    backends = backends or list(BACKEND_DRIVERS) + ['json']
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def run(*args):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, *args], cwd=directory, capture_output=True, text=True, check=True).stdout
+        return time.perf_counter() - start, output
+
+    bare = min(run('-c', 'pass')[0] for _ in range(repeat))
+    results = []
+    for backend in backends:
+        runs = [run('-c', STARTUP_SCRIPT, backend) for _ in range(repeat)]
+        timings = [json.loads(output) for _, output in runs]
+        error = timings[0][2]
+        results.append([
+            backend,
+            f"{min(timing[0] for timing in timings) * 1000:.1f}",
+            '-' if error else f"{min(timing[1] for timing in timings) * 1000:.1f}",
+            f"{min(timing[0] + timing[1] for timing in timings) * 1000:.1f}",
+            f"{min(seconds for seconds, _ in runs) * 1000:.1f}",
+            error or ''
+        ])
+    print(f"bare interpreter:  {bare * 1000:8.1f} ms")
+    print(tabulate(results, headers=['backend', 'import main ms', 'driver ms', 'startup ms', 'process ms', 'error'], tablefmt="pretty"))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Database Viewer and Exporter.")
+    parser.add_argument('--suite', choices=['micro', 'pipeline', 'startup', 'all'], default='all')
+    parser.add_argument('--rows', type=int, default=20000, help="rows per synthetic source")
+    parser.add_argument('--width', type=int, default=4, help="encrypted columns per row")
+    parser.add_argument('--distinct', type=int, default=1000, help="distinct ciphertexts per column (0 for all distinct)")
+    parser.add_argument('--chains', default=','.join(CHAINS), help="comma-separated chains: " + ', '.join(CHAINS))
+    parser.add_argument('--sources', default='sqlite,json')
+    parser.add_argument('--workers', type=int, default=4, help="workers of the parallel mode")
+    parser.add_argument('--workdir', help="directory for the synthetic files (default: system temp)")
+    args = parser.parse_args()
+
+    # Failed trial decryptions would otherwise dominate the timings with log I/O
+    logging.disable(logging.CRITICAL)
+    if args.suite in ('micro', 'all'):
+        bench_decryptor()
+        bench_column_plans()
+        bench_decrypt_cache()
+        bench_envelope()
+    if args.suite in ('pipeline', 'all'):
+        bench_pipeline(args.rows, args.width, args.distinct, args.chains.split(','), args.sources.split(','), args.workers, args.workdir)
+    if args.suite in ('startup', 'all'):
+        bench_startup()
+
+if __name__ == "__main__":
+    main()
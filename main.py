@@ -1,39 +1,445 @@
-import sqlite3
-import mysql.connector
-import psycopg2
-import pyodbc
 import json
 import csv
+import gzip
+import io
 import zlib
 import logging
-from tabulate import tabulate
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives.asymmetric import rsa, padding, ec
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+import argparse
 import base64
+import binascii
+import codecs
+import mmap
+import sys
+import queue
+import re
 import os
+import itertools
+import threading
+import time
+import datetime
+import atexit
+from contextlib import contextmanager, redirect_stdout
 import hashlib
-import bcrypt
-from concurrent.futures import ThreadPoolExecutor
+import hmac
+import importlib
+from collections import deque, Counter, OrderedDict
+from array import array
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported on first attribute access.
+    Resolved attributes are stored on the instance, so later lookups are plain attribute reads.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('_'):
+            raise AttributeError(attribute)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attribute)
+        setattr(self, attribute, value)
+        return value
+
+# Crypto primitives and the console table formatter, imported when first used
+fernet = LazyModule('cryptography.fernet')
+hashes = LazyModule('cryptography.hazmat.primitives.hashes')
+serialization = LazyModule('cryptography.hazmat.primitives.serialization')
+pbkdf2 = LazyModule('cryptography.hazmat.primitives.kdf.pbkdf2')
+rsa = LazyModule('cryptography.hazmat.primitives.asymmetric.rsa')
+padding = LazyModule('cryptography.hazmat.primitives.asymmetric.padding')
+ec = LazyModule('cryptography.hazmat.primitives.asymmetric.ec')
+ciphers = LazyModule('cryptography.hazmat.primitives.ciphers')
+algorithms = LazyModule('cryptography.hazmat.primitives.ciphers.algorithms')
+modes = LazyModule('cryptography.hazmat.primitives.ciphers.modes')
+backends = LazyModule('cryptography.hazmat.backends')
+tabulate = LazyModule('tabulate')
+# Only the asyncio job mode needs the event loop
+asyncio = LazyModule('asyncio')
+
+# Driver module and package of each database backend; a run only imports the driver of
+# the backend it reads from, so the other drivers need not be installed
+BACKEND_DRIVERS = {
+    'sqlite': ('sqlite3', None),
+    'mysql': ('mysql.connector', 'mysql-connector-python'),
+    'postgresql': ('psycopg2', 'psycopg2'),
+    'mssql': ('pyodbc', 'pyodbc'),
+}
+
+# Optional accelerators (numpy, pyarrow, zstandard, ijson) and async drivers (asyncpg,
+# aiomysql), imported on first use; None when not installed
+_optional_modules = {}
+
+def load_driver(db_type):
+    """
+    Imports and returns the driver module of a database backend.
+    """
+    if db_type not in BACKEND_DRIVERS:
+        raise ValueError(f"Unsupported database type: {db_type}")
+    module, package = BACKEND_DRIVERS[db_type]
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise ImportError(f"The {db_type} backend requires the {package} package: {e}") from e
+
+def optional_module(name):
+    """
+    Imports an optional module on first use. Returns None if it is not installed.
+    """
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            _optional_modules[name] = None
+    return _optional_modules[name]
 
 # Configure logging
 logging.basicConfig(filename='database_viewer.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def derive_key(password, salt):
+# Number of rows pulled from the cursor per round trip
+BATCH_SIZE = 1000
+
+# Maximum number of rows printed to the console
+PREVIEW_ROWS = 20
+
+# Number of decryption workers (1 keeps decryption on the calling thread)
+DECRYPT_WORKERS = 1
+
+# Number of rows handed to a decryption worker at a time
+DECRYPT_CHUNK_SIZE = 250
+
+# Number of cells per column sampled before a decryption plan is fixed
+PLAN_SAMPLE_SIZE = 20
+
+# Envelope cells: ENVELOPE_MAGIC, a flags byte, the 2-byte big-endian length of the
+# RSA-OAEP wrapped data key, the wrapped key, a 16-byte IV and the AES-CFB payload
+ENVELOPE_MAGIC = b'ENV1'
+ENVELOPE_ZLIB = 0x01
+
+# Memory cap in bytes of the unwrapped envelope data keys kept per session
+ENVELOPE_KEY_CACHE_SIZE = 1024 * 1024
+
+# Memory cap in bytes of the decrypted-value cache, when enabled with decrypt_cache
+DECRYPT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Approximate bookkeeping bytes per cache entry (digest, dict slot and linked-list node)
+CACHE_ENTRY_OVERHEAD = 120
+
+# Maximum number of open connections per database
+POOL_SIZE = 5
+
+# Seconds an unused pooled connection is kept before it is closed
+POOL_IDLE_TIMEOUT = 300
+
+# Bytes of a SQLite database file memory-mapped by each connection (PRAGMA mmap_size)
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# Bytes of PostgreSQL COPY output handed from the copying thread to the reader at a time
+PG_COPY_CHUNK_SIZE = 1024 * 1024
+
+# COPY output chunks buffered ahead of the reader
+PG_COPY_PREFETCH = 4
+
+# Shortest decoded base64 value treated as ciphertext when JSON fields are auto-detected
+MIN_ENCRYPTED_BYTES = 16
+
+# Characters of URL-safe base64
+BASE64_URLSAFE = re.compile(r'[A-Za-z0-9_-]*={0,2}')
+
+# Export formats that can be appended to (checkpoint resume, incremental exports)
+APPENDABLE_FORMATS = ('csv', 'jsonl')
+
+# File keeping the high-water marks of incremental exports
+INCREMENTAL_STATE_FILE = 'export_state.json'
+
+# Maximum number of batch jobs running at the same time
+MAX_PARALLEL_JOBS = 4
+
+# Fetched batches buffered between an async job and its decrypt/export thread
+ASYNC_PREFETCH = 4
+
+# Seconds a producer waits on a full queue before checking whether its consumer stopped
+QUEUE_POLL_INTERVAL = 0.1
+
+# Exit codes of the command-line interface
+EXIT_OK = 0
+EXIT_JOB_FAILED = 1
+EXIT_USAGE = 2
+
+# Options that identify the source of a job rather than how it is processed
+SOURCE_OPTIONS = ('db_type', 'database', 'host', 'server', 'user', 'password', 'file')
+
+# Prefix of metric names in the Prometheus text format
+METRICS_PREFIX = 'dbviewer'
+
+# Upper bounds in seconds of the timing histogram buckets
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+# Per-cell failures logged per algorithm before sampling starts, and the sampling interval after that
+FAILURE_LOG_BURST = 10
+FAILURE_LOG_SAMPLE = 1000
+
+class Metrics:
+    """
+    Thread-safe counters and histograms, each keyed by name and a set of labels.
+    """
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds value to a counter and returns its new total.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            total = self.counters.get(key, 0) + value
+            self.counters[key] = total
+        return total
+
+    def observe(self, name, value, **labels):
+        """
+        Records one value in a histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Records the duration of the with block in a histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def counter_values(self):
+        """
+        Returns a copy of the counters, keyed by (name, labels).
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def merge(self, counters):
+        """
+        Adds counters keyed by (name, labels), e.g. those recorded in a worker process.
+        """
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        """
+        Returns all metrics as a JSON-serializable dict, plus derived rates.
+        """
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                histograms.setdefault(name, []).append({
+                    'labels': dict(labels),
+                    'count': histogram['count'],
+                    'sum': histogram['sum'],
+                    'buckets': {str(bound): count for bound, count in zip(self.buckets, histogram['counts'])},
+                })
+        export_bytes = sum(entry['value'] for entry in counters.get('export_bytes', []))
+        export_seconds = sum(entry['sum'] for entry in histograms.get('export_seconds', []))
+        return {
+            'counters': counters,
+            'histograms': histograms,
+            'rates': {'export_bytes_per_sec': export_bytes / export_seconds if export_seconds else 0.0},
+        }
+
+    def to_prometheus(self, prefix=METRICS_PREFIX):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        def render_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{render_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    lines.append(f"{metric}_bucket{render_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{metric}_bucket{render_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{metric}_sum{render_labels(labels)} {histogram['sum']}")
+                lines.append(f"{metric}_count{render_labels(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+# Metrics of this process
+metrics = Metrics()
+
+def write_metrics(path):
+    """
+    Writes the metrics summary as JSON.
+    """
+    with open(path, 'w') as f:
+        json.dump(metrics.summary(), f, indent=4)
+
+def write_prometheus(path):
+    """
+    Atomically writes the metrics in the Prometheus text format (e.g. for the node_exporter textfile collector).
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(metrics.to_prometheus())
+    os.replace(tmp_path, path)
+
+def log_failure(algorithm, message, error):
+    """
+    Counts a failed per-cell decryption and logs it, rate-limited per algorithm: the first
+    FAILURE_LOG_BURST failures are logged, then one in every FAILURE_LOG_SAMPLE.
+    """
+    count = metrics.inc('decrypt_failures', algorithm=algorithm)
+    if count <= FAILURE_LOG_BURST or count % FAILURE_LOG_SAMPLE == 0:
+        logging.error(f"{message}: {error} ({count} {algorithm} failures so far)")
+
+# PBKDF2 iterations used by derive_key
+KDF_ITERATIONS = 100000
+
+# Seconds a derived key stays in the key cache
+KEY_CACHE_TTL = 24 * 60 * 60
+
+# Encrypted on-disk key cache (None keeps derived keys in memory only)
+KEY_CACHE_FILE = None
+
+# Environment variable holding the secret that encrypts the on-disk key cache
+KEY_CACHE_SECRET_ENV = 'DBVIEWER_KEY_CACHE_SECRET'
+
+# Derived keys kept in memory, keyed by (salt, password digest, iterations)
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+def derive_key(password, salt, iterations=None, cache_file=None, ttl=None):
     """
     Derives a key from a password and salt using PBKDF2HMAC.
+    Results are cached in memory for ttl seconds and, if cache_file is set,
+    in an encrypted on-disk cache so later runs skip the derivation.
+    Arguments left as None take the current KDF_ITERATIONS, KEY_CACHE_FILE and KEY_CACHE_TTL.
     """
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend()
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+    iterations = KDF_ITERATIONS if iterations is None else iterations
+    cache_file = KEY_CACHE_FILE if cache_file is None else cache_file
+    ttl = KEY_CACHE_TTL if ttl is None else ttl
+    cache_key = (salt, hashlib.sha256(password.encode()).digest(), iterations)
+    now = time.time()
+    with _key_cache_lock:
+        cached = _key_cache.get(cache_key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    key = None
+    if cache_file:
+        key = load_cached_key(cache_file, password, salt, iterations)
+    if key is None:
+        kdf = pbkdf2.PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=iterations,
+            backend=backends.default_backend()
+        )
+        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+        if cache_file:
+            store_cached_key(cache_file, password, salt, iterations, key, ttl)
+
+    with _key_cache_lock:
+        _key_cache[cache_key] = (key, now + ttl)
+    return key
+
+def _key_cache_secret():
+    """
+    Returns the Fernet key protecting the on-disk key cache, derived from the secret in the
+    KEY_CACHE_SECRET_ENV environment variable, so the cache file alone does not reveal keys.
+    """
+    secret = os.environ.get(KEY_CACHE_SECRET_ENV)
+    if not secret:
+        raise ValueError(f"The key cache needs a secret in the {KEY_CACHE_SECRET_ENV} environment variable.")
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+
+def _key_cache_id(secret, password, salt, iterations):
+    # Keyed hash, so the cache file alone cannot be used to test password guesses
+    message = salt + b'\0' + password.encode() + b'\0' + str(iterations).encode()
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+def _read_key_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, 'r') as f:
+        return json.load(f)
+
+def load_cached_key(cache_file, password, salt, iterations):
+    """
+    Returns a derived key from the on-disk cache, or None if it is missing or expired.
+    """
+    try:
+        secret = _key_cache_secret()
+        entry = _read_key_cache(cache_file).get(_key_cache_id(secret, password, salt, iterations))
+        if not entry or entry['expires'] <= time.time():
+            return None
+        return fernet.Fernet(secret).decrypt(entry['key'].encode())
+    except (OSError, ValueError, KeyError, fernet.InvalidToken) as e:
+        logging.error(f"Error reading key cache: {e}")
+        return None
+
+def store_cached_key(cache_file, password, salt, iterations, key, ttl=None):
+    """
+    Stores a derived key in the on-disk cache, dropping expired entries.
+    """
+    ttl = KEY_CACHE_TTL if ttl is None else ttl
+    try:
+        secret = _key_cache_secret()
+        now = time.time()
+        entries = {cache_id: entry for cache_id, entry in _read_key_cache(cache_file).items() if entry.get('expires', 0) > now}
+        entries[_key_cache_id(secret, password, salt, iterations)] = {
+            'key': fernet.Fernet(secret).encrypt(key).decode(),
+            'expires': now + ttl
+        }
+        tmp_file = cache_file + '.tmp'
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_file, cache_file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error writing key cache: {e}")
 
 def decrypt_aes(encrypted_data, key):
     """
@@ -45,7 +451,7 @@ def decrypt_aes(encrypted_data, key):
         ciphertext = encrypted_data[16:]
 
         # Create a Cipher object
-        cipher = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend())
+        cipher = ciphers.Cipher(algorithms.AES(key), modes.CFB(iv), backend=backends.default_backend())
         decryptor = cipher.decryptor()
 
         # Decrypt the data
@@ -65,7 +471,7 @@ def decrypt_des(encrypted_data, key):
         ciphertext = encrypted_data[8:]
 
         # Create a Cipher object
-        cipher = Cipher(algorithms.TripleDES(key), modes.CFB(iv), backend=default_backend())
+        cipher = ciphers.Cipher(algorithms.TripleDES(key), modes.CFB(iv), backend=backends.default_backend())
         decryptor = cipher.decryptor()
 
         # Decrypt the data
@@ -85,7 +491,7 @@ def decrypt_3des(encrypted_data, key):
         ciphertext = encrypted_data[8:]
 
         # Create a Cipher object
-        cipher = Cipher(algorithms.TripleDES(key), modes.CFB(iv), backend=default_backend())
+        cipher = ciphers.Cipher(algorithms.TripleDES(key), modes.CFB(iv), backend=backends.default_backend())
         decryptor = cipher.decryptor()
 
         # Decrypt the data
@@ -179,273 +585,2665 @@ def decrypt_combined(encrypted_data, key, private_key=None):
         logging.error(f"Combined decryption failed: {e}")
         return None
 
+# Markers used by column decryption plans
+PLAINTEXT = 'plaintext'
+MIXED = 'mixed'
+NO_FIT = object()
+
+class DecryptCache:
+    """
+    Bounded LRU cache of decrypted values keyed by a digest of the ciphertext, so repeated
+    ciphertexts (low-cardinality encrypted columns) are only decrypted once.
+    The cache holds at most max_bytes of (approximate) memory.
+    """
+    def __init__(self, max_bytes=DECRYPT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(encrypted_data):
+        return hashlib.blake2b(encrypted_data, digest_size=16).digest()
+
+    def get(self, digest):
+        """
+        Returns (True, value) for a cached digest, otherwise (False, None).
+        """
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, digest, value):
+        size = sys.getsizeof(value) + CACHE_ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if digest in self.entries:
+                return
+            self.entries[digest] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
+
+class Decryptor:
+    """
+    Reusable cell decryptor built once per session from the derived key and the loaded private key.
+    Algorithm objects and padding parameters are created up front, so decrypting a cell only
+    splits the IV and runs the cipher update/finalize.
+    With cache_size, decrypted values are kept in a DecryptCache of that many bytes, except for
+    the columns (indices or names) in uncached_columns.
+    """
+    def __init__(self, key, private_key=None, cache_size=0, uncached_columns=()):
+        self.key = key
+        self.private_key = private_key
+        self.cache = DecryptCache(cache_size) if cache_size else None
+        # Cache hits and misses already added to the metrics, by cache name
+        self.recorded_cache_stats = {}
+        self.uncached_columns = set(uncached_columns)
+        # Per-thread tallies of decrypted cells by chain, added to the metrics once per batch
+        self.tallies = threading.local()
+        self.backend = backends.default_backend()
+        # Bound once, so the per-cell path does no module attribute lookups
+        self.cipher = ciphers.Cipher
+        self.cfb = modes.CFB
+        self.aes = self._build_algorithm(algorithms.AES, 'AES')
+        self.tdes = self._build_algorithm(algorithms.TripleDES, '3DES')
+        self.rsa_key = private_key if isinstance(private_key, rsa.RSAPrivateKey) else None
+        self.ecc_key = private_key if isinstance(private_key, ec.EllipticCurvePrivateKey) else None
+        self.oaep = padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
+        )
+        self.ecdh = ec.ECDH()
+        # Unwrapped envelope data keys, as ready-to-use AES algorithm objects
+        self.data_keys = DecryptCache(ENVELOPE_KEY_CACHE_SIZE)
+        self.steps = self._build_steps()
+        self.step_map = dict(self.steps, envelope=self.decrypt_envelope)
+
+    def _build_algorithm(self, algorithm, name):
+        # A key the algorithm rejects would fail on every cell, so skip that step for the session
+        try:
+            return algorithm(self.key)
+        except Exception as e:
+            logging.error(f"{name} decryption disabled for this session: {e}")
+            return None
+
+    def _decrypt_cfb(self, algorithm, iv_size, encrypted_data, name):
+        if algorithm is None:
+            return None
+        try:
+            decryptor = self.cipher(algorithm, self.cfb(encrypted_data[:iv_size]), backend=self.backend).decryptor()
+            return decryptor.update(encrypted_data[iv_size:]) + decryptor.finalize()
+        except Exception as e:
+            log_failure(name.lower(), f"{name} decryption failed", e)
+            return None
+
+    def decrypt_aes(self, encrypted_data):
+        return self._decrypt_cfb(self.aes, 16, encrypted_data, 'AES')
+
+    def decrypt_des(self, encrypted_data):
+        return self._decrypt_cfb(self.tdes, 8, encrypted_data, 'DES')
+
+    def decrypt_3des(self, encrypted_data):
+        return self._decrypt_cfb(self.tdes, 8, encrypted_data, '3DES')
+
+    def decrypt_rsa(self, encrypted_data):
+        try:
+            return self.rsa_key.decrypt(encrypted_data, self.oaep)
+        except Exception as e:
+            log_failure('rsa', "RSA decryption failed", e)
+            return None
+
+    def decrypt_ecc(self, encrypted_data):
+        try:
+            return self.ecc_key.decrypt(encrypted_data, self.ecdh)
+        except Exception as e:
+            log_failure('ecc', "ECC decryption failed", e)
+            return None
+
+    def decompress(self, compressed_data):
+        try:
+            return zlib.decompress(compressed_data)
+        except Exception as e:
+            log_failure('zlib', "Decompression failed", e)
+            return None
+
+    def parse_envelope(self, encrypted_data):
+        """
+        Splits an envelope cell into (flags, wrapped key, IV, payload), or returns None if it is not one.
+        """
+        if not encrypted_data.startswith(ENVELOPE_MAGIC):
+            return None
+        header = len(ENVELOPE_MAGIC) + 3
+        if len(encrypted_data) < header:
+            return None
+        flags = encrypted_data[len(ENVELOPE_MAGIC)]
+        key_length = int.from_bytes(encrypted_data[len(ENVELOPE_MAGIC) + 1:header], 'big')
+        if len(encrypted_data) < header + key_length + 16:
+            return None
+        wrapped_key = encrypted_data[header:header + key_length]
+        iv = encrypted_data[header + key_length:header + key_length + 16]
+        return flags, wrapped_key, iv, encrypted_data[header + key_length + 16:]
+
+    def unwrap_data_key(self, wrapped_key):
+        """
+        Returns the AES algorithm for an RSA-wrapped data key. Each distinct wrapped key is
+        unwrapped with the private key once and then served from the data key cache.
+        """
+        digest = self.data_keys.digest(wrapped_key)
+        found, algorithm = self.data_keys.get(digest)
+        if found:
+            return algorithm
+        data_key = self.decrypt_rsa(wrapped_key)
+        algorithm = algorithms.AES(data_key) if data_key is not None else None
+        if algorithm is not None:
+            self.data_keys.put(digest, algorithm)
+        return algorithm
+
+    def decrypt_envelope(self, encrypted_data):
+        """
+        Decrypts an envelope cell (RSA-wrapped AES data key followed by the AES payload).
+        Returns None if the cell is not an envelope or cannot be opened with the session key.
+        """
+        if self.rsa_key is None:
+            return None
+        envelope = self.parse_envelope(encrypted_data)
+        if envelope is None:
+            return None
+        flags, wrapped_key, iv, payload = envelope
+        try:
+            algorithm = self.unwrap_data_key(wrapped_key)
+            if algorithm is None:
+                return None
+            decryptor = self.cipher(algorithm, self.cfb(iv), backend=self.backend).decryptor()
+            data = decryptor.update(payload) + decryptor.finalize()
+            return zlib.decompress(data) if flags & ENVELOPE_ZLIB else data
+        except Exception as e:
+            log_failure('envelope', "Envelope decryption failed", e)
+            return None
+
+    def _build_steps(self):
+        # Ordered (name, function) pairs of the combined chain that can apply to this session
+        steps = []
+        if self.rsa_key is not None:
+            steps.append(('rsa', self.decrypt_rsa))
+        if self.aes is not None:
+            steps.append(('aes', self.decrypt_aes))
+        if self.tdes is not None:
+            steps.append(('des', self.decrypt_des))
+            steps.append(('3des', self.decrypt_3des))
+        if self.ecc_key is not None:
+            steps.append(('ecc', self.decrypt_ecc))
+        steps.append(('zlib', self.decompress))
+        return steps
+
+    def options(self):
+        """
+        Extra constructor arguments needed to rebuild this decryptor in a worker process.
+        """
+        return {
+            'cache_size': self.cache.max_bytes if self.cache is not None else 0,
+            'uncached_columns': list(self.uncached_columns),
+        }
+
+    def set_columns(self, names):
+        """
+        Resolves uncached column names to the column indices of a result set.
+        """
+        self.uncached_columns.update(index for index, name in enumerate(names) if name in self.uncached_columns)
+
+    def probe(self, encrypted_data):
+        """
+        Runs the full combined chain and returns (value, chain), where chain is the tuple of
+        step names that succeeded, or PLAINTEXT when the result is not text.
+        Envelope cells are opened with their own data key instead of the chain.
+        """
+        if self.rsa_key is not None and encrypted_data.startswith(ENVELOPE_MAGIC):
+            decrypted_data = self.decrypt_envelope(encrypted_data)
+            if decrypted_data is not None:
+                try:
+                    value = decrypted_data.decode('utf-8')
+                    self._count_chain(('envelope',))
+                    return value, ('envelope',)
+                except UnicodeDecodeError:
+                    return None, PLAINTEXT
+        chain = []
+        try:
+            for name, step in self.steps:
+                decrypted_data = step(encrypted_data)
+                if decrypted_data is not None:
+                    encrypted_data = decrypted_data
+                    chain.append(name)
+            value = encrypted_data.decode('utf-8') if isinstance(encrypted_data, bytes) else encrypted_data
+            chain = tuple(chain)
+            self._count_chain(chain)
+            return value, chain
+        except Exception as e:
+            log_failure('combined', "Combined decryption failed", e)
+            return None, PLAINTEXT
+
+    def _count_chain(self, chain):
+        try:
+            self.tallies.chains[chain] += 1
+        except AttributeError:
+            self.tallies.chains = Counter({chain: 1})
+
+    def flush_counts(self):
+        """
+        Adds the cells this thread decrypted since the last flush to the cells_decrypted metric.
+        """
+        chains = getattr(self.tallies, 'chains', None)
+        if not chains:
+            return
+        self.tallies.chains = Counter()
+        cells = Counter()
+        for chain, count in chains.items():
+            for name in chain:
+                cells[name] += count
+        for name, count in cells.items():
+            metrics.inc('cells_decrypted', count, algorithm=name)
+
+    def apply_chain(self, encrypted_data, chain):
+        """
+        Applies only the given chain of steps. Returns NO_FIT if a step fails or the result is not text.
+        """
+        if chain is PLAINTEXT:
+            return None
+        for name in chain:
+            encrypted_data = self.step_map[name](encrypted_data)
+            if encrypted_data is None:
+                return NO_FIT
+        try:
+            value = encrypted_data.decode('utf-8') if isinstance(encrypted_data, bytes) else encrypted_data
+        except UnicodeDecodeError:
+            return NO_FIT
+        self._count_chain(chain)
+        return value
+
+    def decrypt(self, encrypted_data):
+        """
+        Same algorithm chain as decrypt_combined, using the precomputed session state.
+        """
+        return self.probe(encrypted_data)[0]
+
+    def decrypt_cell(self, column, encrypted_data):
+        """
+        Decrypts a cell of the given column (index, or field name for JSON records),
+        going through the decrypted-value cache when it is enabled for the column.
+        """
+        if self.cache is None or column in self.uncached_columns:
+            return self.decrypt_value(column, encrypted_data)
+        digest = self.cache.digest(encrypted_data)
+        found, value = self.cache.get(digest)
+        if found:
+            return value
+        value = self.decrypt_value(column, encrypted_data)
+        self.cache.put(digest, value)
+        return value
+
+    def decrypt_value(self, column, encrypted_data):
+        """
+        Decrypts a cell of the given column without the cache.
+        """
+        return self.decrypt(encrypted_data)
+
+    def record_cache_stats(self):
+        """
+        Adds the cache hits and misses since the last call to the cache_hits and cache_misses metrics.
+        """
+        for name, cache in (('decrypted-value', self.cache), ('envelope data key', self.data_keys)):
+            if cache is None:
+                continue
+            hits, misses = self.recorded_cache_stats.get(name, (0, 0))
+            if cache.hits > hits:
+                metrics.inc('cache_hits', cache.hits - hits, cache=name)
+            if cache.misses > misses:
+                metrics.inc('cache_misses', cache.misses - misses, cache=name)
+            self.recorded_cache_stats[name] = (cache.hits, cache.misses)
+
+    def log_cache_stats(self):
+        self.record_cache_stats()
+        for name, cache in (('Decrypted-value', self.cache), ('Envelope data key', self.data_keys)):
+            if cache is not None and cache.hits + cache.misses:
+                stats = cache.stats()
+                logging.info(
+                    f"{name} cache: {stats['hits']} hits, {stats['misses']} misses "
+                    f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries, {stats['bytes']} bytes"
+                )
+
+class PlannedDecryptor(Decryptor):
+    """
+    Decryptor that learns the algorithm chain of each column from its first sample_size cells.
+    Once every sample agrees, only that chain is applied to the column (or nothing, if the
+    column is not encrypted text); a cell that does not fit the plan falls back to full probing.
+    Column plans are tied to one result set, so use a new instance per query.
+    """
+    def __init__(self, key, private_key=None, sample_size=PLAN_SAMPLE_SIZE, cache_size=0, uncached_columns=()):
+        super().__init__(key, private_key, cache_size, uncached_columns)
+        self.sample_size = sample_size
+        self.samples = {}
+        self.plans = {}
+        self.lock = threading.Lock()
+
+    def options(self):
+        options = super().options()
+        options['sample_size'] = self.sample_size
+        return options
+
+    def decrypt_value(self, column, encrypted_data):
+        plan = self.plans.get(column)
+        if plan is None:
+            value, chain = self.probe(encrypted_data)
+            self._learn(column, chain)
+            return value
+        if plan is MIXED:
+            return self.decrypt(encrypted_data)
+        value = self.apply_chain(encrypted_data, plan)
+        if value is NO_FIT:
+            return self.decrypt(encrypted_data)
+        return value
+
+    def _learn(self, column, chain):
+        with self.lock:
+            if column in self.plans:
+                return
+            observed = self.samples.setdefault(column, [])
+            observed.append(chain)
+            if len(observed) >= self.sample_size:
+                self.plans[column] = chain if all(c == chain for c in observed) else MIXED
+                del self.samples[column]
+                logging.info(f"Column {column} decryption plan: {self.plans[column]}")
+
+class Backend:
+    """
+    A database backend: connects, lists tables, describes a table's columns and streams the
+    rows of a query. Rows of every backend go through the same decrypt/export pipeline
+    (process_rows); subclasses only override what their driver does differently.
+    options are the fetch options, used by backend-specific fast paths.
+    """
+    db_type = None
+    # Catalog query returning one table name per row
+    tables_query = None
+
+    def __init__(self, **options):
+        self.options = options
+
+    def connect(self, **kwargs):
+        raise NotImplementedError
+
+    def list_tables(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(self.tables_query)
+        return [table[0] for table in cursor.fetchall()]
+
+    def describe_columns(self, conn, table, database=None):
+        """
+        Returns the column names of a table in order, or an empty list if it does not exist.
+        """
+        raise NotImplementedError
+
+    def primary_key(self, conn, table, database=None):
+        """
+        Returns the primary key columns of a table in order.
+        """
+        raise NotImplementedError
+
+    def scan_key(self, conn, table, database=None):
+        """
+        Returns the column used to order and partition a table scan: the single-column primary key.
+        """
+        keys = self.primary_key(conn, table, database)
+        if len(keys) != 1:
+            raise ValueError(f"Table '{table}' needs a single-column primary key for a partitioned scan.")
+        return keys[0]
+
+    def stream_cursor(self, conn, batch_size=BATCH_SIZE):
+        """
+        Returns a cursor that streams a large result set instead of loading it at once.
+        """
+        cursor = conn.cursor()
+        cursor.arraysize = batch_size
+        return cursor
+
+    def stream_rows(self, conn, query, params, columns, batch_size=BATCH_SIZE):
+        """
+        Yields lists of fetched rows, filling columns (if empty) once the result set is open.
+        """
+        cursor = self.stream_cursor(conn, batch_size)
+        execute_query(cursor, self.db_type, query, params)
+        for rows in iter_batches(cursor, batch_size):
+            if not columns:
+                columns.extend(column[0] for column in cursor.description)
+            yield rows
+        if not columns and cursor.description:
+            columns.extend(column[0] for column in cursor.description)
+
+class SqliteBackend(Backend):
+    db_type = 'sqlite'
+    tables_query = "SELECT name FROM sqlite_master WHERE type='table'"
+
+    def connect(self, **kwargs):
+        # Pooled connections may be handed to a different thread on checkout
+        conn = load_driver('sqlite').connect(kwargs['database'], check_same_thread=False)
+        # Read pages through a memory map instead of a read() call per page
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        return conn
+
+    def describe_columns(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM pragma_table_info(?)", (table,))
+        return [column[0] for column in cursor.fetchall()]
+
+    def scan_key(self, conn, table, database=None):
+        # rowid orders every table that is not declared WITHOUT ROWID
+        return 'rowid'
+
+class MysqlBackend(Backend):
+    db_type = 'mysql'
+    tables_query = "SHOW TABLES"
+
+    def connect(self, **kwargs):
+        return load_driver('mysql').connect(
+            host=kwargs['host'],
+            user=kwargs['user'],
+            password=kwargs['password'],
+            database=kwargs['database'],
+            consume_results=True
+        )
+
+    def describe_columns(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = %s AND TABLE_SCHEMA = %s ORDER BY ORDINAL_POSITION",
+            (table, database)
+        )
+        return [column[0] for column in cursor.fetchall()]
+
+    def primary_key(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' ORDER BY ORDINAL_POSITION",
+            (database, table)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def stream_cursor(self, conn, batch_size=BATCH_SIZE):
+        # Unbuffered cursor (mysql-connector's SSCursor) so rows are read from the socket as they are consumed
+        return conn.cursor(buffered=False)
+
+# Converters of COPY text values by PostgreSQL type OID (bool, bytea, int8, int2, int4, oid,
+# float4, float8, numeric); values of other types are kept as text
+PG_COPY_CONVERTERS = {
+    16: lambda value: value == 't',
+    17: lambda value: bytes.fromhex(value[2:]),
+    20: int,
+    21: int,
+    23: int,
+    26: int,
+    700: float,
+    701: float,
+    1700: Decimal,
+}
+
+# Backslash escapes of the COPY text format
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+COPY_ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+def parse_copy_row(line, converters):
+    """
+    Parses one row of COPY text format: tab-separated, backslash-escaped fields with \\N for NULL.
+    """
+    values = []
+    for field, convert in zip(line.split('\t'), converters):
+        if field == '\\N':
+            values.append(None)
+            continue
+        if '\\' in field:
+            field = COPY_ESCAPE_PATTERN.sub(lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), field)
+        values.append(convert(field) if convert else field)
+    return tuple(values)
+
+class CopyStream:
+    """
+    File-like target of psycopg2's copy_expert. COPY runs in its own thread; its output is
+    handed to the reading thread in chunks of about chunk_size bytes and split into lines.
+    """
+    def __init__(self, chunk_size=PG_COPY_CHUNK_SIZE, prefetch=PG_COPY_PREFETCH):
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.chunks = queue.Queue(maxsize=prefetch)
+        self.stopped = threading.Event()
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self._put(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def _put(self, item):
+        # Raising from write() aborts the COPY once the reader stopped
+        if not put_until_stopped(self.chunks, item, self.stopped):
+            raise RuntimeError("COPY reader stopped.")
+
+    def run(self, cursor, sql):
+        try:
+            cursor.copy_expert(sql, self)
+            self._flush()
+            self._put(None)
+        except Exception as e:
+            if not self.stopped.is_set():
+                self._put(e)
+
+    def lines(self):
+        tail = b''
+        while True:
+            item = self.chunks.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            lines = (tail + item).split(b'\n')
+            tail = lines.pop()
+            yield from lines
+        if tail:
+            yield tail
+
+    def stop(self):
+        self.stopped.set()
+
+class PostgresBackend(Backend):
+    """
+    PostgreSQL backend. Rows stream through a server-side cursor, or with the pg_copy option
+    through COPY ... TO STDOUT, which skips the per-row cursor protocol.
+    """
+    db_type = 'postgresql'
+    tables_query = "SELECT table_name FROM information_schema.tables WHERE table_schema='public'"
+
+    def connect(self, **kwargs):
+        return load_driver('postgresql').connect(
+            host=kwargs['host'],
+            user=kwargs['user'],
+            password=kwargs['password'],
+            dbname=kwargs['database']
+        )
+
+    def describe_columns(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position", (table,))
+        return [column[0] for column in cursor.fetchall()]
+
+    def primary_key(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = %s::regclass AND i.indisprimary",
+            # regclass folds unquoted names to lower case
+            (quote_identifier(self.db_type, table),)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def stream_cursor(self, conn, batch_size=BATCH_SIZE):
+        # Named (server-side) cursor so PostgreSQL streams rows in batches
+        cursor = conn.cursor(name='stream_cursor')
+        cursor.itersize = batch_size
+        return cursor
+
+    def stream_rows(self, conn, query, params, columns, batch_size=BATCH_SIZE):
+        if self.options.get('pg_copy'):
+            return self.copy_rows(conn, query, params, columns, batch_size)
+        return super().stream_rows(conn, query, params, columns, batch_size)
+
+    def copy_rows(self, conn, query, params, columns, batch_size=BATCH_SIZE):
+        """
+        Streams the rows of query with COPY ... TO STDOUT in text format. Values are converted
+        back by column type (PG_COPY_CONVERTERS); other types, such as dates, arrive as text.
+        """
+        cursor = conn.cursor()
+        execute_query(cursor, self.db_type, f"SELECT * FROM ({query}) AS copy_source LIMIT 0", params)
+        if not columns:
+            columns.extend(column.name for column in cursor.description)
+        converters = [PG_COPY_CONVERTERS.get(column.type_code) for column in cursor.description]
+        sql = f"COPY ({query}) TO STDOUT"
+        if params:
+            sql = cursor.mogrify(sql, params).decode()
+        encoding = load_driver('postgresql').extensions.encodings.get(conn.encoding, 'utf-8')
+        stream = CopyStream()
+        copier = threading.Thread(target=stream.run, args=(conn.cursor(), sql), daemon=True)
+        copier.start()
+        try:
+            rows = []
+            for line in stream.lines():
+                rows.append(parse_copy_row(line.decode(encoding), converters))
+                if len(rows) == batch_size:
+                    metrics.inc('rows_fetched', len(rows))
+                    yield rows
+                    rows = []
+            if rows:
+                metrics.inc('rows_fetched', len(rows))
+                yield rows
+        finally:
+            stream.stop()
+            copier.join()
+
+class MssqlBackend(Backend):
+    db_type = 'mssql'
+    tables_query = "SELECT table_name FROM information_schema.tables WHERE table_type='BASE TABLE'"
+
+    def connect(self, **kwargs):
+        return load_driver('mssql').connect(
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={kwargs['server']};DATABASE={kwargs['database']};UID={kwargs['user']};PWD={kwargs['password']}"
+        )
+
+    def describe_columns(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute("SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ? ORDER BY ORDINAL_POSITION", (table,))
+        return [column[0] for column in cursor.fetchall()]
+
+    def primary_key(self, conn, table, database=None):
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT kcu.COLUMN_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc "
+            "JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu ON tc.CONSTRAINT_NAME = kcu.CONSTRAINT_NAME AND tc.TABLE_NAME = kcu.TABLE_NAME "
+            "WHERE tc.TABLE_NAME = ? AND tc.CONSTRAINT_TYPE = 'PRIMARY KEY' ORDER BY kcu.ORDINAL_POSITION",
+            (table,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+# Backend class of each database type
+BACKENDS = {
+    'sqlite': SqliteBackend,
+    'mysql': MysqlBackend,
+    'postgresql': PostgresBackend,
+    'mssql': MssqlBackend,
+}
+
+def get_backend(db_type, **options):
+    """
+    Returns the backend of a database type, configured with the fetch options.
+    """
+    if db_type not in BACKENDS:
+        raise ValueError(f"Unsupported database type: {db_type}")
+    return BACKENDS[db_type](**options)
+
+def open_connection(db_type, **kwargs):
+    """
+    Opens a new driver connection for the given database type, recording the connect time.
+    """
+    with metrics.timer('connect_seconds', db_type=db_type):
+        conn = get_backend(db_type).connect(**kwargs)
+    metrics.inc('connections_opened', db_type=db_type)
+    return conn
+
+def close_quietly(conn):
+    """
+    Closes a connection, ignoring errors from connections that are already broken.
+    """
+    try:
+        conn.close()
+    except Exception as e:
+        logging.error(f"Error closing connection: {e}")
+
+class ConnectionPool:
+    """
+    Bounded pool of connections to one database.
+    At most `size` connections are checked out at once; idle connections older than
+    `idle_timeout` seconds are closed instead of being reused.
+    """
+    def __init__(self, factory, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _prune(self):
+        # Idle connections are appended on release, so the oldest are on the left
+        now = time.monotonic()
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            close_quietly(self.idle.popleft()[0])
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            with self.lock:
+                self._prune()
+                if self.idle:
+                    return self.idle.pop()[0]
+            return self.factory()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        try:
+            if discard:
+                close_quietly(conn)
+                return
+            # End the transaction (and any server-side cursor) before the connection is reused
+            conn.commit()
+            with self.lock:
+                self.idle.append((conn, time.monotonic()))
+        except Exception as e:
+            logging.error(f"Discarding pooled connection: {e}")
+            close_quietly(conn)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                close_quietly(self.idle.popleft()[0])
+
+# Connection details that identify a pool
+CONNECTION_PARAMS = ('database', 'host', 'server', 'user', 'password')
+
+# Connection pools shared by every fetch in the process, keyed by connection details
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_type, **kwargs):
+    """
+    Returns the connection pool for a database, creating it on first use.
+    """
+    params = {name: kwargs[name] for name in CONNECTION_PARAMS if name in kwargs}
+    key = (db_type,) + tuple(params.get(name) for name in CONNECTION_PARAMS)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                lambda: open_connection(db_type, **params),
+                kwargs.get('pool_size', POOL_SIZE),
+                kwargs.get('pool_idle_timeout', POOL_IDLE_TIMEOUT)
+            )
+            _pools[key] = pool
+        return pool
+
+def connection(db_type, **kwargs):
+    """
+    Checks out a pooled connection; use as a context manager to return it afterwards.
+    """
+    return get_pool(db_type, **kwargs).connection()
+
+@atexit.register
+def close_pools():
+    """
+    Closes every idle pooled connection.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
 def fetch_tables(db_type, **kwargs):
     """
     Fetches the list of tables in the database.
     """
     try:
-        if db_type == 'sqlite':
-            with sqlite3.connect(kwargs['database']) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [table[0] for table in cursor.fetchall()]
-                return tables
-
-        elif db_type == 'mysql':
-            with mysql.connector.connect(
-                host=kwargs['host'],
-                user=kwargs['user'],
-                password=kwargs['password'],
-                database=kwargs['database']
-            ) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SHOW TABLES")
-                tables = [table[0] for table in cursor.fetchall()]
-                return tables
-
-        elif db_type == 'postgresql':
-            with psycopg2.connect(
-                host=kwargs['host'],
-                user=kwargs['user'],
-                password=kwargs['password'],
-                dbname=kwargs['database']
-            ) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
-                tables = [table[0] for table in cursor.fetchall()]
-                return tables
-
-        elif db_type == 'mssql':
-            with pyodbc.connect(
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={kwargs['server']};DATABASE={kwargs['database']};UID={kwargs['user']};PWD={kwargs['password']}"
-            ) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_type='BASE TABLE'")
-                tables = [table[0] for table in cursor.fetchall()]
-                return tables
-
-        elif db_type == 'json':
+        if db_type == 'json':
             # JSON files don't have tables, so return a dummy value
             return ["data"]
-
-        else:
-            raise ValueError("Unsupported database type.")
+        backend = get_backend(db_type)
+        with connection(db_type, **kwargs) as conn:
+            return backend.list_tables(conn)
 
     except Exception as e:
         logging.error(f"Error fetching tables: {e}")
         return []
 
-def fetch_data(db_type, **kwargs):
+def execute_query(cursor, db_type, query, params=None):
     """
-    Fetches and decrypts data from the database or JSON file.
+    Executes a data query, recording its duration in the query_seconds histogram.
     """
-    try:
-        if db_type == 'sqlite':
-            with sqlite3.connect(kwargs['database']) as conn:
-                cursor = conn.cursor()
-                table_name = kwargs.get('table')
-                query = kwargs.get('query')
-                if query:
-                    cursor.execute(query)
-                elif table_name:
-                    cursor.execute(f"PRAGMA table_info({table_name})")
-                    columns = [column[1] for column in cursor.fetchall()]
-                    if not columns:
-                        raise ValueError(f"Table '{table_name}' not found in the database.")
-                    cursor.execute(f"SELECT * FROM {table_name}")
-                else:
-                    raise ValueError("Either table name or custom query is required.")
-                rows = cursor.fetchall()
-                if rows:
-                    decrypted_rows = []
-                    for row in rows:
-                        decrypted_row = []
-                        for cell in row:
-                            if isinstance(cell, bytes):
-                                decrypted_cell = decrypt_combined(cell, kwargs['key'], kwargs.get('private_key'))
-                                decrypted_row.append(decrypted_cell if decrypted_cell is not None else cell)
-                            else:
-                                decrypted_row.append(cell)
-                        decrypted_rows.append(decrypted_row)
-                    print(tabulate(decrypted_rows, headers=columns if 'columns' in locals() else [], tablefmt="pretty"))
-                    if kwargs.get('export'):
-                        export_data(decrypted_rows, columns if 'columns' in locals() else [], kwargs['export'])
-                else:
-                    print("No data found.")
-
-        elif db_type == 'mysql':
-            with mysql.connector.connect(
-                host=kwargs['host'],
-                user=kwargs['user'],
-                password=kwargs['password'],
-                database=kwargs['database']
-            ) as conn:
-                cursor = conn.cursor()
-                table_name = kwargs.get('table')
-                query = kwargs.get('query')
-                if query:
-                    cursor.execute(query)
-                elif table_name:
-                    cursor.execute(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{table_name}' AND TABLE_SCHEMA = '{kwargs['database']}'")
-                    columns = [column[0] for column in cursor.fetchall()]
-                    if not columns:
-                        raise ValueError(f"Table '{table_name}' not found in the database.")
-                    cursor.execute(f"SELECT * FROM {table_name}")
-                else:
-                    raise ValueError("Either table name or custom query is required.")
-                rows = cursor.fetchall()
-                if rows:
-                    decrypted_rows = []
-                    for row in rows:
-                        decrypted_row = []
-                        for cell in row:
-                            if isinstance(cell, bytes):
-                                decrypted_cell = decrypt_combined(cell, kwargs['key'], kwargs.get('private_key'))
-                                decrypted_row.append(decrypted_cell if decrypted_cell is not None else cell)
-                            else:
-                                decrypted_row.append(cell)
-                        decrypted_rows.append(decrypted_row)
-                    print(tabulate(decrypted_rows, headers=columns if 'columns' in locals() else [], tablefmt="pretty"))
-                    if kwargs.get('export'):
-                        export_data(decrypted_rows, columns if 'columns' in locals() else [], kwargs['export'])
-                else:
-                    print("No data found.")
-
-        elif db_type == 'postgresql':
-            with psycopg2.connect(
-                host=kwargs['host'],
-                user=kwargs['user'],
-                password=kwargs['password'],
-                dbname=kwargs['database']
-            ) as conn:
-                cursor = conn.cursor()
-                table_name = kwargs.get('table')
-                query = kwargs.get('query')
-                if query:
-                    cursor.execute(query)
-                elif table_name:
-                    cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}'")
-                    columns = [column[0] for column in cursor.fetchall()]
-                    if not columns:
-                        raise ValueError(f"Table '{table_name}' not found in the database.")
-                    cursor.execute(f"SELECT * FROM {table_name}")
-                else:
-                    raise ValueError("Either table name or custom query is required.")
-                rows = cursor.fetchall()
-                if rows:
-                    decrypted_rows = []
-                    for row in rows:
-                        decrypted_row = []
-                        for cell in row:
-                            if isinstance(cell, bytes):
-                                decrypted_cell = decrypt_combined(cell, kwargs['key'], kwargs.get('private_key'))
-                                decrypted_row.append(decrypted_cell if decrypted_cell is not None else cell)
-                            else:
-                                decrypted_row.append(cell)
-                        decrypted_rows.append(decrypted_row)
-                    print(tabulate(decrypted_rows, headers=columns if 'columns' in locals() else [], tablefmt="pretty"))
-                    if kwargs.get('export'):
-                        export_data(decrypted_rows, columns if 'columns' in locals() else [], kwargs['export'])
-                else:
-                    print("No data found.")
-
-        elif db_type == 'mssql':
-            with pyodbc.connect(
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={kwargs['server']};DATABASE={kwargs['database']};UID={kwargs['user']};PWD={kwargs['password']}"
-            ) as conn:
-                cursor = conn.cursor()
-                table_name = kwargs.get('table')
-                query = kwargs.get('query')
-                if query:
-                    cursor.execute(query)
-                elif table_name:
-                    cursor.execute(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{table_name}'")
-                    columns = [column[0] for column in cursor.fetchall()]
-                    if not columns:
-                        raise ValueError(f"Table '{table_name}' not found in the database.")
-                    cursor.execute(f"SELECT * FROM {table_name}")
-                else:
-                    raise ValueError("Either table name or custom query is required.")
-                rows = cursor.fetchall()
-                if rows:
-                    decrypted_rows = []
-                    for row in rows:
-                        decrypted_row = []
-                        for cell in row:
-                            if isinstance(cell, bytes):
-                                decrypted_cell = decrypt_combined(cell, kwargs['key'], kwargs.get('private_key'))
-                                decrypted_row.append(decrypted_cell if decrypted_cell is not None else cell)
-                            else:
-                                decrypted_row.append(cell)
-                        decrypted_rows.append(decrypted_row)
-                    print(tabulate(decrypted_rows, headers=columns if 'columns' in locals() else [], tablefmt="pretty"))
-                    if kwargs.get('export'):
-                        export_data(decrypted_rows, columns if 'columns' in locals() else [], kwargs['export'])
-                else:
-                    print("No data found.")
-
-        elif db_type == 'json':
-            json_file = kwargs.get('file')
-            if not json_file:
-                raise ValueError("JSON file path is required.")
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    print(tabulate(data, headers="keys", tablefmt="pretty"))
-                else:
-                    print(json.dumps(data, indent=4))
-                if kwargs.get('export'):
-                    export_data(data, None, kwargs['export'])
-
+    with metrics.timer('query_seconds', db_type=db_type):
+        if params is None:
+            cursor.execute(query)
         else:
-            raise ValueError("Unsupported database type. Supported types: sqlite, mysql, postgresql, mssql, json.")
+            cursor.execute(query, params)
 
-    except Exception as e:
-        logging.error(f"Error: {e}")
+def iter_batches(cursor, batch_size=BATCH_SIZE):
+    """
+    Yields lists of rows from a cursor using fetchmany, so the full result set is never held in memory.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        metrics.inc('rows_fetched', len(rows))
+        yield rows
 
-def export_data(data, columns, export_format):
+def put_until_stopped(items, item, stopped, timeout=QUEUE_POLL_INTERVAL):
     """
-    Exports data to CSV or JSON format.
+    Puts item on a bounded queue, waiting for room until the stopped event is set, so a
+    producer never blocks forever on a consumer that gave up. Returns whether it was put.
     """
-    try:
-        if export_format == 'csv':
-            with open('output.csv', 'w', newline='') as f:
-                writer = csv.writer(f)
-                if columns:
-                    writer.writerow(columns)
-                if isinstance(data, list):
-                    writer.writerows(data)
-                else:
-                    writer.writerow([data])
-            print("Data exported to output.csv")
-        elif export_format == 'json':
-            with open('output.json', 'w') as f:
-                json.dump(data, f, indent=4)
-            print("Data exported to output.json")
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _decrypt_column(index, values, decryptor):
+    """
+    Decrypts the encrypted (bytes) cells of one column, leaving other cells untouched.
+    """
+    decrypted = []
+    for cell in values:
+        if isinstance(cell, bytes):
+            decrypted_cell = decryptor.decrypt_cell(index, cell)
+            decrypted.append(decrypted_cell if decrypted_cell is not None else cell)
         else:
-            raise ValueError("Unsupported export format. Supported formats: csv, json.")
-    except Exception as e:
-        logging.error(f"Error exporting data: {e}")
+            decrypted.append(cell)
+    return decrypted
 
-def load_private_key(private_key_path):
+def _typed_column(values, types):
     """
-    Loads an RSA or ECC private key from a file.
+    Packs a column whose cells are all int or all float into a typed array.
+    Any other column is returned unchanged.
     """
+    np = optional_module('numpy')
     try:
-        with open(private_key_path, "rb") as key_file:
-            private_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None,
-                backend=default_backend()
-            )
-            return private_key
-    except Exception as e:
-        logging.error(f"Error loading private key: {e}")
+        if types == {int}:
+            return np.array(values, dtype=np.int64) if np is not None else array('q', values)
+        if types == {float}:
+            return np.array(values, dtype=np.float64) if np is not None else array('d', values)
+    except (OverflowError, ValueError):
+        # Integers outside the int64 range stay as Python ints
+        pass
+    return values
+
+def _column_values(values):
+    # Typed arrays are converted back to Python numbers in one C-level call
+    return values.tolist() if hasattr(values, 'tolist') else values
+
+class RowBatch:
+    """
+    Column-oriented batch of decrypted rows.
+    Numeric columns are held in typed arrays (NumPy when available, otherwise array.array),
+    columns without encrypted cells are stored without per-cell Python work, and only
+    columns that contain bytes go through the decryptor.
+    """
+    __slots__ = ('columns', 'num_rows')
+
+    def __init__(self, columns, num_rows):
+        self.columns = columns
+        self.num_rows = num_rows
+
+    @classmethod
+    def from_rows(cls, rows, decryptor):
+        """
+        Transposes fetched rows into columns and decrypts the encrypted ones.
+        """
+        columns = []
+        for index, values in enumerate(zip(*rows)):
+            types = set(map(type, values))
+            if bytes in types:
+                columns.append(_decrypt_column(index, values, decryptor))
+            else:
+                columns.append(_typed_column(values, types))
+        decryptor.flush_counts()
+        return cls(columns, len(rows))
+
+    def __len__(self):
+        return self.num_rows
+
+    def rows(self):
+        """
+        Returns an iterator over the batch as row tuples.
+        """
+        if not self.columns:
+            return iter([()] * self.num_rows)
+        return zip(*[_column_values(values) for values in self.columns])
+
+    def to_arrow(self, names=None):
+        """
+        Converts the batch to a pyarrow RecordBatch (requires pyarrow).
+        """
+        pa = optional_module('pyarrow')
+        np = optional_module('numpy')
+        if pa is None:
+            raise RuntimeError("pyarrow is required for Arrow record batches.")
+        names = names or [f"column{i}" for i in range(len(self.columns))]
+        arrays = [arrow_array(values if np is not None and isinstance(values, np.ndarray) else _column_values(values)) for values in self.columns]
+        return pa.RecordBatch.from_arrays(arrays, names=list(names))
+
+def arrow_array(values):
+    """
+    Builds a pyarrow array, falling back to strings for columns with mixed types
+    (e.g. decrypted text next to cells that could not be decrypted).
+    """
+    pa = optional_module('pyarrow')
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values])
+
+# Per-process decryptor, set once by _init_decrypt_worker
+_worker_decryptor = None
+
+# Metric counters of this worker process already sent to the parent
+_worker_sent_counters = {}
+
+def _init_decrypt_worker(decryptor_class, key, private_key_pem, options):
+    """
+    Initializes a decryption worker process with the session key material.
+    """
+    global _worker_decryptor
+    private_key = None
+    if private_key_pem:
+        private_key = serialization.load_pem_private_key(private_key_pem, password=None, backend=backends.default_backend())
+    _worker_decryptor = decryptor_class(key, private_key, **options)
+
+def _decrypt_rows_in_worker(rows):
+    """
+    Decrypts a chunk of rows into a RowBatch inside a worker process. Returns the batch and
+    the metric counts it added (cells decrypted, failures, cache hits), which only the parent reports.
+    """
+    global _worker_sent_counters
+    batch = RowBatch.from_rows(rows, _worker_decryptor)
+    _worker_decryptor.record_cache_stats()
+    counters = metrics.counter_values()
+    added = {key: value - _worker_sent_counters.get(key, 0) for key, value in counters.items() if value != _worker_sent_counters.get(key, 0)}
+    _worker_sent_counters = counters
+    return batch, added
+
+class DecryptionEngine:
+    """
+    Decrypts batches of rows in parallel while preserving row order.
+    Uses a thread pool by default; use_processes=True switches to a process pool,
+    which needs the private key to be re-loaded in every worker.
+    """
+    def __init__(self, decryptor, workers=None, chunk_size=DECRYPT_CHUNK_SIZE, use_processes=False):
+        self.decryptor = decryptor
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.use_processes = use_processes
+        if use_processes:
+            private_key_pem = None
+            if decryptor.private_key is not None:
+                private_key_pem = decryptor.private_key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.PKCS8,
+                    encryption_algorithm=serialization.NoEncryption()
+                )
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_decrypt_worker,
+                initargs=(type(decryptor), decryptor.key, private_key_pem, decryptor.options())
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, chunk):
+        """
+        Submits a chunk of rows and returns a concurrent.futures.Future of its decrypted RowBatch
+        (with processes, of the RowBatch and the worker's metric counts; see result()).
+        """
+        if self.use_processes:
+            # Driver row objects are not always picklable
+            return self.executor.submit(_decrypt_rows_in_worker, [tuple(row) for row in chunk])
+        return self.executor.submit(RowBatch.from_rows, chunk, self.decryptor)
+
+    def result(self, future):
+        """
+        Waits for a submitted chunk and returns its RowBatch, adding a worker process's metric counts to ours.
+        """
+        if not self.use_processes:
+            return future.result()
+        batch, counters = future.result()
+        metrics.merge(counters)
+        return batch
+
+    def _chunks(self, batches):
+        for batch in batches:
+            for start in range(0, len(batch), self.chunk_size):
+                yield batch[start:start + self.chunk_size]
+
+    def decrypt_stream(self, batches):
+        """
+        Yields decrypted RowBatch chunks in input order. At most two chunks per worker are
+        in flight, so memory stays bounded while the cursor keeps fetching.
+        """
+        pending = deque()
+        for chunk in self._chunks(batches):
+            pending.append(self.submit(chunk))
+            if len(pending) >= self.workers * 2:
+                yield self.result(pending.popleft())
+        while pending:
+            yield self.result(pending.popleft())
+
+def decrypt_batches(raw_batches, decryptor, workers=DECRYPT_WORKERS, use_processes=False):
+    """
+    Turns an iterable of fetched row lists into decrypted RowBatches.
+    With more than one worker, batches are decrypted by a DecryptionEngine.
+    """
+    try:
+        if workers <= 1:
+            for rows in raw_batches:
+                yield RowBatch.from_rows(rows, decryptor)
+            return
+
+        with DecryptionEngine(decryptor, workers, use_processes=use_processes) as engine:
+            yield from engine.decrypt_stream(raw_batches)
+    finally:
+        decryptor.log_cache_stats()
+
+def count_batches(batches, counter):
+    """
+    Passes batches through while counting their rows in counter['rows'].
+    """
+    for batch in batches:
+        counter['rows'] += len(batch)
+        yield batch
+
+def process_rows(raw_batches, columns, **kwargs):
+    """
+    Shared row-processing pipeline of the database backends: decrypts the fetched row lists
+    of a backend's stream_rows and passes them to present_batches. columns is filled by the
+    backend once the result set is open. Returns the number of rows processed.
+    """
+    try:
+        first = next(raw_batches, None)
+        decryptor = make_decryptor(**kwargs)
+        # Column names are known now, so name-based cache opt-outs can be resolved
+        decryptor.set_columns(columns)
+        batches = decrypt_batches(
+            itertools.chain([first] if first is not None else [], raw_batches),
+            decryptor,
+            kwargs.get('workers', DECRYPT_WORKERS),
+            kwargs.get('use_processes', False)
+        )
+        return present_batches(batches, lambda: columns, **kwargs)
+    finally:
+        raw_batches.close()
+
+def make_decryptor(**kwargs):
+    """
+    Returns the decryptor for one result set: kwargs['decryptor'] if given, otherwise a
+    Decryptor (or PlannedDecryptor with plan_columns) built from the key material.
+    """
+    decryptor = kwargs.get('decryptor')
+    if decryptor is not None:
+        return decryptor
+    cache_size = kwargs.get('decrypt_cache_size', DECRYPT_CACHE_SIZE) if kwargs.get('decrypt_cache') else 0
+    uncached_columns = kwargs.get('uncached_columns', ())
+    if kwargs.get('plan_columns'):
+        return PlannedDecryptor(kwargs['key'], kwargs.get('private_key'), kwargs.get('plan_sample_size', PLAN_SAMPLE_SIZE), cache_size, uncached_columns)
+    return Decryptor(kwargs['key'], kwargs.get('private_key'), cache_size, uncached_columns)
+
+def present_batches(batches, result_columns, **kwargs):
+    """
+    Shared tail of every fetch: prints a bounded preview of a batch stream and streams all
+    batches to the exporter. result_columns is called once the first batch has been read
+    and returns the column names (None for records that carry their own keys).
+    With drain=True and no export, every row is still fetched and decrypted.
+    Returns the number of rows processed.
+    """
+    preview_rows = kwargs.get('preview_rows', PREVIEW_ROWS)
+    try:
+        # Read batches until there is one row more than the preview, so we know whether it is truncated
+        head = []
+        head_rows = 0
+        for batch in batches:
+            head.append(batch)
+            head_rows += len(batch)
+            if head_rows > preview_rows:
+                break
+        if not head_rows:
+            print("No data found.")
+            return 0
+        columns = result_columns()
+
+        if preview_rows:
+            preview = itertools.islice(itertools.chain.from_iterable(batch.rows() for batch in head), preview_rows)
+            print(tabulate.tabulate(list(preview), headers="keys" if columns is None else columns, tablefmt="pretty"))
+            if head_rows > preview_rows:
+                print(f"Showing first {preview_rows} rows.")
+
+        counter = {'rows': 0}
+        if kwargs.get('export'):
+            export_batches(
+                count_batches(itertools.chain(head, batches), counter),
+                columns,
+                kwargs['export'],
+                kwargs.get('output'),
+                kwargs.get('compression'),
+                kwargs.get('max_file_size'),
+                kwargs.get('append', False),
+                kwargs.get('on_written')
+            )
+        elif kwargs.get('drain'):
+            for _ in count_batches(itertools.chain(head, batches), counter):
+                pass
+        else:
+            counter['rows'] = min(head_rows, preview_rows)
+        return counter['rows']
+    finally:
+        # Release the decryption workers even if the stream was not drained
+        batches.close()
+
+def decode_base64(value, min_length=0):
+    """
+    Decodes a standard or URL-safe base64 string, returning None if it is not valid base64
+    or decodes to fewer than min_length bytes.
+    """
+    if len(value) % 4 or not value:
+        return None
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        try:
+            data = base64.urlsafe_b64decode(value) if BASE64_URLSAFE.fullmatch(value) else None
+        except (binascii.Error, ValueError):
+            data = None
+    if data is None or len(data) < min_length:
+        return None
+    return data
+
+def decrypt_record(record, decryptor, encrypted_fields=None):
+    """
+    Decrypts base64-encoded encrypted string fields of a JSON record in place.
+    With encrypted_fields, only those fields are decrypted; otherwise every string that
+    decodes to at least MIN_ENCRYPTED_BYTES bytes is tried and kept only if it decrypts to text.
+    """
+    for field, value in record.items():
+        if not isinstance(value, str) or (encrypted_fields is not None and field not in encrypted_fields):
+            continue
+        data = decode_base64(value, 0 if encrypted_fields is not None else MIN_ENCRYPTED_BYTES)
+        if data is None:
+            continue
+        decrypted_value = decryptor.decrypt_cell(field, data)
+        if decrypted_value is not None:
+            record[field] = decrypted_value
+    return record
+
+class RecordBatch:
+    """
+    Batch of JSON records (dicts) flowing through the same preview and export path as RowBatch.
+    """
+    __slots__ = ('records',)
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def rows(self):
+        return iter(self.records)
+
+    def to_arrow(self, names=None):
+        pa = optional_module('pyarrow')
+        if pa is None:
+            raise RuntimeError("pyarrow is required for Arrow record batches.")
+        return pa.RecordBatch.from_pylist(self.records)
+
+def detect_json_layout(source, path):
+    """
+    Returns 'lines' for JSON Lines, 'array' for a top-level array or 'object' for a single object.
+    The source position is restored afterwards.
+    """
+    if path.endswith(('.jsonl', '.ndjson')):
+        return 'lines'
+    head = source.read(4096).lstrip()
+    source.seek(0)
+    if head.startswith(b'['):
+        return 'array'
+    if head.startswith(b'{'):
+        # More than one value on separate lines means JSON Lines
+        first_line = source.readline()
+        rest = source.read(4096).strip()
+        source.seek(0)
+        try:
+            json.loads(first_line)
+        except ValueError:
+            return 'object'
+        return 'lines' if rest else 'object'
+    raise ValueError("JSON file must contain an array of records, JSON Lines or a single object.")
+
+def _read_json_lines(source):
+    for line in iter(source.readline, b''):
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def _read_json_array(source, chunk_size=1 << 20):
+    """
+    Incrementally decodes the elements of a top-level JSON array, reading chunk_size bytes at a time.
+    A malformed element is reported as soon as it is read, without buffering the rest of the file.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    whitespace = re.compile(r'\s*')
+    number_chars = re.compile(r'[0-9.eE+-]*')
+    # Longest token that can be cut off by a chunk boundary and still fail to decode (\uXXXX, -Infinity)
+    partial_token = 16
+    # offset is the position in the file of the start of buffer
+    buffer, pos, eof, offset = '', 0, False, 0
+    state = 'start'
+    while True:
+        pos = whitespace.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array.")
+            need_data = True
+        else:
+            need_data = False
+            char = buffer[pos]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError("JSON file must contain an array of records.")
+                pos += 1
+                state = 'first'
+            elif state == 'separator':
+                if char == ',':
+                    pos += 1
+                    state = 'value'
+                elif char == ']':
+                    return
+                else:
+                    raise ValueError(f"Unexpected character in JSON array at character {offset + pos}: {char!r}")
+            elif state == 'first' and char == ']':
+                return
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    # More data only helps with an error at the end of the buffer or an unfinished string
+                    if eof or (len(buffer) - e.pos > partial_token and not e.msg.startswith('Unterminated string')):
+                        raise ValueError(f"Invalid JSON array element at character {offset + e.pos}: {e.msg}") from e
+                    end = None
+                # A number followed only by number characters (e.g. '1.' or '2e') may continue in the next chunk
+                if end is None or (not eof and isinstance(value, (int, float)) and number_chars.fullmatch(buffer, end)):
+                    need_data = True
+                else:
+                    yield value
+                    pos = end
+                    state = 'separator'
+        if need_data:
+            chunk = source.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+            offset += pos
+            pos = 0
+
+def read_json_records(path, use_mmap=False):
+    """
+    Yields the records of a JSON array or JSON Lines file without loading the whole file.
+    Arrays are parsed with ijson when it is installed, otherwise with a built-in incremental
+    decoder. With use_mmap=True the file is scanned through a read-only memory map.
+    """
+    with open(path, 'rb') as f:
+        source = f
+        if use_mmap and os.path.getsize(path):
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            layout = detect_json_layout(source, path)
+            if layout == 'lines':
+                yield from _read_json_lines(source)
+            elif layout == 'array':
+                ijson = optional_module('ijson')
+                if ijson is not None:
+                    yield from ijson.items(source, 'item', use_float=True)
+                else:
+                    yield from _read_json_array(source)
+            else:
+                yield json.load(source)
+        finally:
+            if source is not f:
+                source.close()
+
+def process_json_file(json_file, **kwargs):
+    """
+    Streams records from a JSON file in batches through decryption, preview and export.
+    A file holding a single object is printed and exported as that object.
+    """
+    decryptor = make_decryptor(**kwargs)
+    encrypted_fields = kwargs.get('encrypted_fields')
+    with open(json_file, 'rb') as f:
+        layout = detect_json_layout(f, json_file)
+    if layout == 'object':
+        with open(json_file, 'r') as f:
+            data = decrypt_record(json.load(f), decryptor, encrypted_fields)
+        decryptor.flush_counts()
+        if kwargs.get('preview_rows', PREVIEW_ROWS):
+            print(json.dumps(data, indent=4))
+        if kwargs.get('export'):
+            export_data(data, None, kwargs['export'], kwargs.get('output'), kwargs.get('compression'), kwargs.get('max_file_size'))
+        return 1
+
+    records = read_json_records(json_file, kwargs.get('use_mmap', False))
+
+    def record_batches():
+        for chunk in iter_chunks(records, kwargs.get('batch_size', BATCH_SIZE)):
+            metrics.inc('rows_fetched', len(chunk))
+            batch = RecordBatch([decrypt_record(record, decryptor, encrypted_fields) for record in chunk])
+            decryptor.flush_counts()
+            yield batch
+
+    batches = record_batches()
+    try:
+        return present_batches(batches, lambda: None, **kwargs)
+    finally:
+        records.close()
+        decryptor.log_cache_stats()
+
+def quote_identifier(db_type, name):
+    """
+    Quotes a (possibly schema-qualified) table or column name for the given database.
+    """
+    if db_type == 'mysql':
+        return '.'.join(f"`{part.replace('`', '``')}`" for part in name.split('.'))
+    if db_type == 'mssql':
+        return '.'.join(f"[{part.replace(']', ']]')}]" for part in name.split('.'))
+    return '.'.join(f'"{part.replace(chr(34), chr(34) * 2)}"' for part in name.split('.'))
+
+def placeholder(db_type):
+    """
+    Returns the parameter placeholder used by the database driver.
+    """
+    return '%s' if db_type in ('mysql', 'postgresql') else '?'
+
+def bind_placeholders(sql, db_type, has_params, paramstyle=None):
+    """
+    Converts the ? parameter markers of a user-written predicate to the driver's style:
+    %s for MySQL and PostgreSQL (escaping literal %, which those drivers only expect when
+    the query has parameters) or $1, $2, ... for asyncpg (paramstyle='numeric').
+    """
+    paramstyle = paramstyle or ('format' if db_type in ('mysql', 'postgresql') else 'qmark')
+    if paramstyle == 'format' and has_params:
+        return sql.replace('%', '%%').replace('?', '%s')
+    if paramstyle == 'numeric':
+        parts = sql.split('?')
+        return parts[0] + ''.join(f"${index}{part}" for index, part in enumerate(parts[1:], 1))
+    return sql
+
+def select_clause(db_type, columns, default='*'):
+    """
+    Returns the quoted select list of a column projection, or default without one.
+    """
+    return ', '.join(quote_identifier(db_type, column) for column in columns) if columns else default
+
+def build_table_query(db_type, table, columns=None, where=None, params=None, limit=None, paramstyle=None):
+    """
+    Builds the SELECT of table mode with the column projection, WHERE predicate and row limit
+    pushed down to the database. The predicate marks each value of params with ?; the values
+    are bound by the driver. Returns (query, params), with params None when there are none.
+    """
+    params = list(params or [])
+    query = f"SELECT {select_clause(db_type, columns)} FROM {quote_identifier(db_type, table)}"
+    if where:
+        query += f" WHERE {bind_placeholders(where, db_type, bool(params), paramstyle)}"
+    if limit is not None:
+        if db_type == 'mssql':
+            query = f"SELECT TOP ({int(limit)}) {query[len('SELECT '):]}"
+        else:
+            query += f" LIMIT {int(limit)}"
+    return query, params or None
+
+def table_select(db_type, available, **kwargs):
+    """
+    Returns (query, params, columns) of a table-mode fetch from the select_columns, where,
+    params and limit options. Selected columns are checked against the table's columns.
+    """
+    table = kwargs['table']
+    selected = kwargs.get('select_columns')
+    if selected:
+        unknown = [column for column in selected if column not in available]
+        if unknown:
+            raise ValueError(f"Unknown columns in table '{table}': {', '.join(unknown)}")
+    query, params = build_table_query(db_type, table, selected, kwargs.get('where'), kwargs.get('params'), kwargs.get('limit'))
+    return query, params, list(selected) if selected else available
+
+def split_key_range(low, high, partitions, after=None):
+    """
+    Splits the key range [low, high] into at most `partitions` (exclusive lower, inclusive upper)
+    bounds. The first lower bound is `after` and the last upper bound is open, so rows outside
+    the sampled range are still read. Non-integer keys are scanned as a single partition.
+    """
+    if partitions <= 1 or not isinstance(low, int) or not isinstance(high, int) or isinstance(low, bool) or high <= low:
+        return [(after, None)]
+    span = high - low + 1
+    partitions = min(partitions, span)
+    cuts = [low - 1 + (span * i) // partitions for i in range(1, partitions)]
+    return list(zip([after] + cuts, cuts + [None]))
+
+class PartitionedScan:
+    """
+    Reads a table in key order with keyset pagination (WHERE key > last ORDER BY key LIMIT n),
+    split into key ranges that are fetched concurrently over pooled connections.
+    Batches are yielded in key order: later partitions buffer at most `prefetch` pages each
+    until the consumer reaches them.
+    """
+    def __init__(self, db_type, table, key_column, partitions, batch_size=BATCH_SIZE, prefetch=2,
+                 select_columns=None, where=None, where_params=None, **kwargs):
+        self.db_type = db_type
+        self.table = table
+        self.key_column = key_column
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.select_columns = select_columns
+        self.where = where
+        self.where_params = list(where_params or [])
+        self.kwargs = kwargs
+        self.stopped = threading.Event()
+        # (rows yielded so far, last key) for every yielded page, consumed by the on_written checkpoint callback
+        self.pages = deque()
+        self.rows_yielded = 0
+
+    def page_query(self, has_lower, has_upper, limit=None):
+        limit = self.batch_size if limit is None else limit
+        key = quote_identifier(self.db_type, self.key_column)
+        table = quote_identifier(self.db_type, self.table)
+        select_list = select_clause(self.db_type, self.select_columns, f"{table}.*")
+        conditions = []
+        if has_lower:
+            conditions.append(f"{key} > {placeholder(self.db_type)}")
+        if has_upper:
+            conditions.append(f"{key} <= {placeholder(self.db_type)}")
+        if self.where:
+            has_params = bool(has_lower or has_upper or self.where_params)
+            conditions.append(f"({bind_placeholders(self.where, self.db_type, has_params)})")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        if self.db_type == 'mssql':
+            return f"SELECT TOP {limit} {key}, {select_list} FROM {table}{where} ORDER BY {key}"
+        return f"SELECT {key}, {select_list} FROM {table}{where} ORDER BY {key} LIMIT {limit}"
+
+    def page_params(self, lower, upper):
+        """
+        Returns the parameters of page_query for the given bounds, or None if it has none.
+        """
+        params = [value for value in (lower, upper) if value is not None] + self.where_params
+        return params or None
+
+    def _scan_partition(self, lower, upper, pages):
+        try:
+            last = lower
+            while not self.stopped.is_set():
+                params = self.page_params(last, upper)
+                # The connection is only held for one page, so partitions never wait on each other for the pool
+                with connection(self.db_type, **self.kwargs) as conn:
+                    cursor = conn.cursor()
+                    execute_query(cursor, self.db_type, self.page_query(last is not None, upper is not None), params)
+                    rows = cursor.fetchall()
+                if not rows:
+                    break
+                metrics.inc('rows_fetched', len(rows))
+                last = rows[-1][0]
+                put_until_stopped(pages, (rows, last), self.stopped)
+                if len(rows) < self.batch_size:
+                    break
+            put_until_stopped(pages, None, self.stopped)
+        except Exception as e:
+            put_until_stopped(pages, e, self.stopped)
+
+    def raw_batches(self):
+        """
+        Yields fetched row lists (without the leading key column) in key order.
+        """
+        ranges = self.partitions
+        page_queues = [queue.Queue(maxsize=self.prefetch) for _ in ranges]
+        executor = ThreadPoolExecutor(max_workers=len(ranges))
+        try:
+            for (lower, upper), pages in zip(ranges, page_queues):
+                executor.submit(self._scan_partition, lower, upper, pages)
+            for pages in page_queues:
+                while True:
+                    item = pages.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    rows, last = item
+                    self.rows_yielded += len(rows)
+                    self.pages.append((self.rows_yielded, last))
+                    yield [row[1:] for row in rows]
+        finally:
+            self.stopped.set()
+            executor.shutdown(wait=True)
+
+def read_state_file(state_file):
+    """
+    Returns the contents of a JSON state file (scan checkpoint, incremental export marks),
+    or None if there is none.
+    """
+    if not state_file or not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def write_state_file(state_file, state):
+    """
+    Atomically writes a JSON state file.
+    """
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def fetch_partitioned(db_type, **kwargs):
+    """
+    Table mode with a partitioned, keyset-paginated scan.
+    The key range is split into kwargs['partitions'] ranges read concurrently and merged in key order.
+    With kwargs['checkpoint'], progress is saved after every exported batch; if the checkpoint file
+    exists, the scan resumes after the last exported key and appends to the export (which must be
+    an uncompressed, single-file csv or jsonl export). The checkpoint is removed once the scan completes.
+    """
+    table = kwargs['table']
+    if kwargs.get('limit') is not None:
+        raise ValueError("A row limit cannot be combined with partitioned or checkpointed scans.")
+    checkpoint_file = kwargs.get('checkpoint')
+    state = read_state_file(checkpoint_file)
+    if state and (state['db_type'], state['table']) != (db_type, table):
+        raise ValueError(f"Checkpoint {checkpoint_file} belongs to {state['db_type']} table '{state['table']}'.")
+
+    with connection(db_type, **kwargs) as conn:
+        key_column = get_backend(db_type, **kwargs).scan_key(conn, table, kwargs.get('database'))
+        after = state['last_key'] if state else None
+        cursor = conn.cursor()
+        key = quote_identifier(db_type, key_column)
+        if after is None:
+            cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM {quote_identifier(db_type, table)}")
+        else:
+            cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM {quote_identifier(db_type, table)} WHERE {key} > {placeholder(db_type)}", (after,))
+        low, high = cursor.fetchone()
+        if checkpoint_file and isinstance(low, (bytes, bytearray, memoryview)):
+            raise ValueError(f"Cannot checkpoint a scan on binary {key_column} values.")
+        partitions = split_key_range(low, high, kwargs.get('partitions', 1), after)
+        scan = PartitionedScan(
+            db_type, table, key_column, partitions, kwargs.get('batch_size', BATCH_SIZE),
+            select_columns=kwargs.get('select_columns'), where=kwargs.get('where'), where_params=kwargs.get('params'),
+            **{name: kwargs[name] for name in CONNECTION_PARAMS if name in kwargs}
+        )
+        execute_query(cursor, db_type, scan.page_query(False, False, limit=0), scan.page_params(None, None))
+        columns = [column[0] for column in cursor.description][1:]
+        cursor.fetchall()
+
+    options = dict(kwargs)
+    if checkpoint_file and kwargs.get('export'):
+        export_format, compression = parse_export_format(kwargs['export'], kwargs.get('compression'))
+        if export_format not in APPENDABLE_FORMATS or compression or kwargs.get('max_file_size'):
+            raise ValueError(f"Checkpoints need an uncompressed, single-file {' or '.join(APPENDABLE_FORMATS)} export.")
+        if state:
+            # Drop anything written after the last checkpoint before appending
+            with open(state['output'], 'r+b') as f:
+                f.truncate(state['output_size'])
+            options['output'] = state['output']
+            options['append'] = True
+            print(f"Resuming {table} after {key_column} = {after} ({state['rows']} rows already exported).")
+        written = {'rows': state['rows'] if state else 0, 'batch_rows': 0}
+
+        def on_written(batch, writer):
+            # Checkpoint the last key of every page whose rows have all been written
+            written['batch_rows'] += len(batch)
+            last_key = None
+            while scan.pages and scan.pages[0][0] <= written['batch_rows']:
+                last_key = scan.pages.popleft()[1]
+            if last_key is None:
+                return
+            output, output_size = writer.position()
+            write_state_file(checkpoint_file, {
+                'db_type': db_type,
+                'table': table,
+                'key_column': key_column,
+                'last_key': watermark_value(last_key),
+                'rows': written['rows'] + written['batch_rows'],
+                'output': output,
+                'output_size': output_size,
+            })
+        options['on_written'] = on_written
+
+    completed = {'done': False}
+
+    def tracked():
+        yield from scan.raw_batches()
+        completed['done'] = True
+
+    rows = process_rows(tracked(), columns, **options)
+    if completed['done'] and checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return rows
+
+def watermark_value(value):
+    """
+    Converts a high-water mark or checkpoint key to a JSON value that can be bound back into a query.
+    Timestamps, decimals and other non-numeric values are stored as strings.
+    """
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        return value
+    return str(value)
+
+def fetch_incremental(db_type, **kwargs):
+    """
+    Table mode that only reads rows added or changed since the previous run.
+    The high-water mark (the largest kwargs['watermark_column'] value exported; by default the
+    primary key, or rowid for SQLite) is kept per (backend, host, database, table) in kwargs['state_file'].
+    New rows are appended to the export, which must be an uncompressed, single-file csv or jsonl export.
+    The mark only advances once every new row has been read and exported.
+    """
+    table = kwargs['table']
+    if kwargs.get('limit') is not None:
+        raise ValueError("A row limit cannot be combined with incremental exports.")
+    state_file = kwargs.get('state_file', INCREMENTAL_STATE_FILE)
+    # Without an export the new rows would only be previewed, yet the mark would pass them
+    if not kwargs.get('export'):
+        raise ValueError("Incremental mode needs an export (--export csv or jsonl).")
+    export_format, compression = parse_export_format(kwargs['export'], kwargs.get('compression'))
+    if export_format not in APPENDABLE_FORMATS or compression or kwargs.get('max_file_size'):
+        raise ValueError(f"Incremental exports need an uncompressed, single-file {' or '.join(APPENDABLE_FORMATS)} export.")
+    marks = read_state_file(state_file) or {}
+    # Shards often share a database name, so the server is part of the key
+    server = kwargs.get('host') or kwargs.get('server') or ''
+    state_key = f"{db_type}:{server}:{kwargs.get('database') or ''}:{table}"
+    batch_size = kwargs.get('batch_size', BATCH_SIZE)
+
+    backend = get_backend(db_type, **kwargs)
+    with connection(db_type, **kwargs) as conn:
+        column = kwargs.get('watermark_column') or backend.scan_key(conn, table, kwargs.get('database'))
+        mark = marks.get(state_key, {}).get('value') if marks.get(state_key, {}).get('column') == column else None
+        key = quote_identifier(db_type, column)
+        source = quote_identifier(db_type, table)
+        select_list = select_clause(db_type, kwargs.get('select_columns'), f"{source}.*")
+        where_params = list(kwargs.get('params') or [])
+
+        def where_clause(conditions, params):
+            # Watermark conditions plus the where option, with all their parameters
+            params = params + where_params
+            if kwargs.get('where'):
+                conditions = conditions + [f"({bind_placeholders(kwargs['where'], db_type, bool(params))})"]
+            return (f" WHERE {' AND '.join(conditions)}" if conditions else ""), params or None
+
+        skipped = 0
+        if mark is not None:
+            cursor = conn.cursor()
+            clause, params = where_clause([f"{key} <= {placeholder(db_type)}"], [mark])
+            execute_query(cursor, db_type, f"SELECT COUNT(*) FROM {source}{clause}", params)
+            skipped = cursor.fetchone()[0]
+
+        if mark is None:
+            clause, params = where_clause([], [])
+        else:
+            clause, params = where_clause([f"{key} > {placeholder(db_type)}"], [mark])
+        # The watermark column leads every row; it is tracked and then dropped
+        result_columns = []
+        columns = []
+        fetched = backend.stream_rows(conn, f"SELECT {key}, {select_list} FROM {source}{clause} ORDER BY {key}", params, result_columns, batch_size)
+        progress = {'mark': mark, 'done': False}
+
+        def raw_batches():
+            # Rows come in watermark order, so the last non-null value of each batch is the new mark
+            try:
+                for rows in fetched:
+                    if not columns:
+                        columns.extend(result_columns[1:])
+                    for row in reversed(rows):
+                        if row[0] is not None:
+                            progress['mark'] = row[0]
+                            break
+                    yield [row[1:] for row in rows]
+                if not columns:
+                    columns.extend(result_columns[1:])
+                progress['done'] = True
+            finally:
+                fetched.close()
+
+        options = dict(kwargs)
+        options['append'] = True
+        rows = process_rows(raw_batches(), columns, **options)
+
+    since = f" ({column} <= {mark})" if mark is not None else ""
+    print(f"Incremental export of {table}: {rows} new rows, {skipped} rows skipped{since}.")
+    if progress['done'] and progress['mark'] is not None:
+        marks = read_state_file(state_file) or {}
+        marks[state_key] = {'column': column, 'value': watermark_value(progress['mark'])}
+        write_state_file(state_file, marks)
+    return rows
+
+def fetch_data(db_type, **kwargs):
+    """
+    Fetches and decrypts data from the database or JSON file.
+    Returns the number of rows processed, or None if the fetch failed.
+    """
+    try:
+        return _fetch_data(db_type, **kwargs)
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return None
+
+def _fetch_data(db_type, **kwargs):
+    """
+    Implementation of fetch_data that raises on failure.
+    """
+    if db_type == 'json':
+        json_file = kwargs.get('file')
+        if not json_file:
+            raise ValueError("JSON file path is required.")
+        return process_json_file(json_file, **kwargs)
+    if db_type not in BACKENDS:
+        raise ValueError("Unsupported database type. Supported types: sqlite, mysql, postgresql, mssql, json.")
+
+    if kwargs.get('table') and not kwargs.get('query'):
+        if kwargs.get('incremental'):
+            return fetch_incremental(db_type, **kwargs)
+        if kwargs.get('partitions', 1) > 1 or kwargs.get('checkpoint'):
+            return fetch_partitioned(db_type, **kwargs)
+
+    backend = get_backend(db_type, **kwargs)
+    with connection(db_type, **kwargs) as conn:
+        columns = []
+        query = kwargs.get('query')
+        if query:
+            query, params = select_query(db_type, **kwargs)
+        else:
+            table_name = kwargs.get('table')
+            if not table_name:
+                raise ValueError("Either table name or custom query is required.")
+            available = backend.describe_columns(conn, table_name, kwargs.get('database'))
+            if not available:
+                raise ValueError(f"Table '{table_name}' not found in the database.")
+            query, params, columns = table_select(db_type, available, **kwargs)
+        raw_batches = backend.stream_rows(conn, query, params, columns, kwargs.get('batch_size', BATCH_SIZE))
+        return process_rows(raw_batches, columns, **kwargs)
+
+def select_query(db_type, paramstyle=None, **kwargs):
+    """
+    Returns the (query, params) a table or custom query job runs. The ? markers of a custom
+    query are converted to the driver's style like those of a where predicate; table mode
+    applies the projection, filter and limit.
+    """
+    if kwargs.get('query'):
+        params = kwargs.get('params')
+        if not params:
+            return kwargs['query'], None
+        return bind_placeholders(kwargs['query'], db_type, True, paramstyle), list(params)
+    if kwargs.get('table'):
+        return build_table_query(
+            db_type, kwargs['table'], kwargs.get('select_columns'), kwargs.get('where'),
+            kwargs.get('params'), kwargs.get('limit'), paramstyle
+        )
+    raise ValueError("Either table name or custom query is required.")
+
+# Converters of string parameters (e.g. --param values) by PostgreSQL type name for asyncpg,
+# which does not cast text to the parameter's type the way psycopg2's quoted literals are cast
+ASYNCPG_PARAM_CONVERTERS = {
+    'bool': lambda value: value.lower() in ('t', 'true', 'y', 'yes', 'on', '1'),
+    'int2': int,
+    'int4': int,
+    'int8': int,
+    'oid': int,
+    'float4': float,
+    'float8': float,
+    'numeric': Decimal,
+    'date': datetime.date.fromisoformat,
+    'timestamp': datetime.datetime.fromisoformat,
+}
+
+def coerce_asyncpg_params(params, parameter_types):
+    """
+    Converts string parameters to the Python type asyncpg expects for each parameter's
+    PostgreSQL type. Other values, and strings bound to other types, are passed unchanged.
+    """
+    return [
+        ASYNCPG_PARAM_CONVERTERS[parameter_type.name](value)
+        if isinstance(value, str) and parameter_type.name in ASYNCPG_PARAM_CONVERTERS else value
+        for value, parameter_type in zip(params, parameter_types)
+    ]
+
+async def _asyncpg_batches(query, params, columns, batch_size, options):
+    # Rows are read through a server-side cursor inside a transaction, as asyncpg requires
+    asyncpg = optional_module('asyncpg')
+    with metrics.timer('connect_seconds', db_type='postgresql'):
+        conn = await asyncpg.connect(host=options['host'], user=options['user'], password=options['password'], database=options['database'])
+    metrics.inc('connections_opened', db_type='postgresql')
+    try:
+        async with conn.transaction():
+            with metrics.timer('query_seconds', db_type='postgresql'):
+                statement = await conn.prepare(query)
+                cursor = await statement.cursor(*coerce_asyncpg_params(params or (), statement.get_parameters()))
+            columns.extend(attribute.name for attribute in statement.get_attributes())
+            while True:
+                records = await cursor.fetch(batch_size)
+                if not records:
+                    break
+                metrics.inc('rows_fetched', len(records))
+                yield [tuple(record) for record in records]
+    finally:
+        await conn.close()
+
+async def _aiomysql_batches(query, params, columns, batch_size, options):
+    # Unbuffered cursor so rows are read from the socket as they are consumed
+    aiomysql = optional_module('aiomysql')
+    with metrics.timer('connect_seconds', db_type='mysql'):
+        conn = await aiomysql.connect(host=options['host'], user=options['user'], password=options['password'], db=options['database'])
+    metrics.inc('connections_opened', db_type='mysql')
+    try:
+        cursor = await conn.cursor(aiomysql.SSCursor)
+        with metrics.timer('query_seconds', db_type='mysql'):
+            await cursor.execute(query, params)
+        columns.extend(column[0] for column in cursor.description)
+        while True:
+            rows = await cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            metrics.inc('rows_fetched', len(rows))
+            yield list(rows)
+        await cursor.close()
+    finally:
+        conn.close()
+
+async def _executor_batches(db_type, query, params, columns, batch_size, options, executor):
+    # Blocking drivers: every call runs in the job's own thread so the event loop keeps serving other
+    # jobs. Waiting for a pool slot there never takes a thread that a job holding a connection needs.
+    loop = asyncio.get_running_loop()
+    pool = get_pool(db_type, **options)
+    conn = await loop.run_in_executor(executor, pool.acquire)
+    completed = False
+    raw_batches = get_backend(db_type, **options).stream_rows(conn, query, params, columns, batch_size)
+    try:
+        while True:
+            rows = await loop.run_in_executor(executor, next, raw_batches, None)
+            if rows is None:
+                break
+            yield rows
+        completed = True
+    finally:
+        await loop.run_in_executor(executor, raw_batches.close)
+        await loop.run_in_executor(executor, pool.release, conn, not completed)
+
+def async_batches(db_type, query, params, columns, batch_size, options, executor):
+    """
+    Returns an async iterator of fetched row lists, filling columns once the result set is open.
+    options holds the connection details. PostgreSQL and MySQL use asyncpg/aiomysql when
+    installed; other drivers run in the job's single-thread executor.
+    """
+    if db_type == 'postgresql' and optional_module('asyncpg') is not None:
+        return _asyncpg_batches(query, params, columns, batch_size, options)
+    if db_type == 'mysql' and optional_module('aiomysql') is not None:
+        return _aiomysql_batches(query, params, columns, batch_size, options)
+    return _executor_batches(db_type, query, params, columns, batch_size, options, executor)
+
+async def _hand_off(handoff, item, stopped, executor):
+    # Waits for room in the job's thread, so a slow consumer never blocks the event loop
+    return await asyncio.get_running_loop().run_in_executor(executor, put_until_stopped, handoff, item, stopped)
+
+def _drain_handoff(handoff, stopped):
+    # Consumer side of the hand-off queue: yields batches until the end marker or an error
+    try:
+        while True:
+            item = handoff.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+async def fetch_data_async(db_type, **kwargs):
+    """
+    Asyncio counterpart of _fetch_data for table and custom query jobs; raises on failure.
+    Rows are fetched on the event loop (or in threads for blocking drivers) and handed to a
+    thread running the shared process_rows pipeline, so network waits overlap with decryption
+    and the export. JSON files, partitioned scans and incremental exports run the blocking
+    implementation in a thread.
+    Every blocking call of a job runs in threads of its own rather than the loop's shared
+    default executor, so jobs waiting for a pool slot cannot starve the jobs holding one.
+    """
+    loop = asyncio.get_running_loop()
+    fetch_thread = ThreadPoolExecutor(max_workers=1)
+    consumer_thread = ThreadPoolExecutor(max_workers=1)
+    try:
+        if db_type == 'json' or kwargs.get('incremental') or kwargs.get('checkpoint') or kwargs.get('partitions', 1) > 1:
+            return await loop.run_in_executor(fetch_thread, lambda: _fetch_data(db_type, **kwargs))
+        paramstyle = 'numeric' if db_type == 'postgresql' and optional_module('asyncpg') is not None else None
+        query, params = select_query(db_type, paramstyle, **kwargs)
+        columns = []
+        source = async_batches(db_type, query, params, columns, kwargs.get('batch_size', BATCH_SIZE), kwargs, fetch_thread)
+        handoff = queue.Queue(maxsize=ASYNC_PREFETCH)
+        stopped = threading.Event()
+        consumer = loop.run_in_executor(
+            consumer_thread, lambda: process_rows(_drain_handoff(handoff, stopped), columns, **kwargs)
+        )
+        try:
+            async for rows in source:
+                if not await _hand_off(handoff, rows, stopped, fetch_thread):
+                    break
+            await _hand_off(handoff, None, stopped, fetch_thread)
+        except Exception as e:
+            await _hand_off(handoff, e, stopped, fetch_thread)
+        finally:
+            await source.aclose()
+        return await consumer
+    finally:
+        # Both threads are idle here; waiting for them would only block the loop
+        fetch_thread.shutdown(wait=False)
+        consumer_thread.shutdown(wait=False)
+
+# File name suffix added for each supported compression
+COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+def parse_export_format(export_format, compression=None):
+    """
+    Splits a format such as 'csv.gz' into ('csv', 'gzip').
+    """
+    if '.' in export_format:
+        export_format, extension = export_format.split('.', 1)
+        compression = {'gz': 'gzip', 'zst': 'zstd'}.get(extension, extension)
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression: {compression}. Supported compressions: gzip, zstd.")
+    return export_format, compression
+
+def export_extension(export_format, compression=None):
+    """
+    Returns the file extension for an export, e.g. '.csv.gz'. Parquet compresses internally.
+    """
+    if export_format == 'parquet':
+        return '.parquet'
+    return f".{export_format}{COMPRESSION_EXTENSIONS[compression]}"
+
+class ExportWriter:
+    """
+    Base class for streaming exporters.
+    Rows are written in chunks as they arrive. When max_file_size is set, output rolls
+    over to numbered part files (output-0001.csv, output-0002.csv, ...) once the current
+    part reaches that many bytes on disk.
+    """
+    export_format = None
+
+    def __init__(self, path, columns, compression=None, max_file_size=None, append=False):
+        if append and (self.export_format not in APPENDABLE_FORMATS or compression or max_file_size):
+            raise ValueError(f"Appending is only supported for uncompressed, single-file {' or '.join(APPENDABLE_FORMATS)} exports.")
+        self.path = path
+        self.columns = columns
+        self.compression = compression
+        self.max_file_size = max_file_size
+        self.append = append
+        self.paths = []
+        self.raw = None
+        self.f = None
+
+    def _part_path(self):
+        if not self.max_file_size:
+            return self.path
+        suffix = export_extension(self.export_format, self.compression)
+        if self.path.endswith(suffix):
+            stem = self.path[:-len(suffix)]
+        else:
+            stem, suffix = os.path.splitext(self.path)
+        return f"{stem}-{len(self.paths) + 1:04d}{suffix}"
+
+    def _open(self):
+        path = self._part_path()
+        self.paths.append(path)
+        self.raw = open(path, 'ab' if self.append else 'wb')
+        # Appending to a file that already has rows: no header
+        self.appending = self.raw.tell() > 0
+        if self.compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            zstandard = optional_module('zstandard')
+            if zstandard is None:
+                raise RuntimeError("zstandard is required for zstd compression.")
+            stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            stream = self.raw
+        self.f = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self.start_file()
+
+    def _close(self):
+        self.end_file()
+        self.f.close()
+        self.raw.close()
+        self.f = None
+
+    def position(self):
+        """
+        Flushes buffered output and returns (current file, bytes written to it).
+        """
+        self.f.flush()
+        return self.paths[-1], self.raw.tell()
+
+    def _roll_if_full(self):
+        if not self.max_file_size:
+            return
+        self.f.flush()
+        if self.raw.tell() >= self.max_file_size:
+            self._close()
+
+    def write_rows(self, rows):
+        for chunk in iter_chunks(rows, BATCH_SIZE):
+            if self.f is None:
+                self._open()
+            self.write_chunk(chunk)
+            self._roll_if_full()
+
+    def write_batch(self, batch):
+        if self.f is None:
+            self._open()
+        self.write_chunk(batch.rows())
+        self._roll_if_full()
+
+    def write_object(self, data):
+        self.write_rows([data])
+
+    def close(self):
+        # An export with no rows still produces a (header-only) file
+        if self.f is None and not self.paths:
+            self._open()
+        if self.f is not None:
+            self._close()
+
+    def start_file(self):
+        pass
+
+    def end_file(self):
+        pass
+
+    def write_chunk(self, rows):
+        raise NotImplementedError
+
+class CsvExportWriter(ExportWriter):
+    export_format = 'csv'
+
+    def start_file(self):
+        self.writer = csv.writer(self.f)
+        self.dict_writer = None
+        self.missing_fields = set()
+        if self.columns and not self.appending:
+            self.writer.writerow(self.columns)
+
+    def write_chunk(self, rows):
+        rows = list(rows)
+        if rows and isinstance(rows[0], dict):
+            # JSON records: the header comes from the keys of the first chunk in the file
+            if self.dict_writer is None:
+                fieldnames = self.columns or list(dict.fromkeys(key for row in rows for key in row))
+                self.dict_writer = csv.DictWriter(self.f, fieldnames=fieldnames, extrasaction='ignore')
+                if not self.appending:
+                    self.dict_writer.writeheader()
+            # The header is already written, so fields that first appear later cannot be added
+            missing = {key for row in rows for key in row}.difference(self.dict_writer.fieldnames, self.missing_fields)
+            if missing:
+                self.missing_fields.update(missing)
+                logging.error(f"CSV export {self.path} has no column for fields {', '.join(sorted(missing))}; they are left out. Export to jsonl to keep them.")
+            self.dict_writer.writerows(rows)
+        else:
+            self.writer.writerows(rows)
+
+    def write_object(self, data):
+        self.write_rows([[data]])
+
+def json_default(value):
+    """
+    Encodes values json cannot: bytes (cells that could not be decrypted) as base64,
+    anything else (dates, decimals, UUIDs) as its string form.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    return str(value)
+
+class JsonExportWriter(ExportWriter):
+    """
+    Writes a JSON array (indent=4) one element at a time; each part file is a complete array.
+    """
+    export_format = 'json'
+    indent = 4
+
+    def start_file(self):
+        self.first = True
+        self.closed_array = False
+
+    def write_chunk(self, rows):
+        prefix = ' ' * self.indent
+        for row in rows:
+            # Serialize first, so a failing row never leaves a dangling separator
+            text = json.dumps(row, indent=self.indent, default=json_default)
+            self.f.write('[\n' if self.first else ',\n')
+            self.f.write(prefix + text.replace('\n', '\n' + prefix))
+            self.first = False
+
+    def write_object(self, data):
+        self._open()
+        json.dump(data, self.f, indent=self.indent, default=json_default)
+        self.closed_array = True
+
+    def end_file(self):
+        if not self.closed_array:
+            self.f.write('[]' if self.first else '\n]')
+
+class JsonLinesExportWriter(ExportWriter):
+    """
+    Writes one compact JSON object per line, keyed by column name when columns are known.
+    """
+    export_format = 'jsonl'
+
+    def write_chunk(self, rows):
+        if self.columns:
+            rows = (row if isinstance(row, dict) else dict(zip(self.columns, row)) for row in rows)
+        self.f.write(''.join(json.dumps(row, default=json_default) + '\n' for row in rows))
+
+class ParquetExportWriter(ExportWriter):
+    """
+    Writes each chunk as a Parquet row group. The schema is taken from the first chunk.
+    """
+    export_format = 'parquet'
+
+    def __init__(self, path, columns, compression=None, max_file_size=None, append=False):
+        super().__init__(path, columns, compression, max_file_size, append)
+        self.schema = None
+        self.parquet = None
+
+    def _open(self):
+        if optional_module('pyarrow.parquet') is None:
+            raise RuntimeError("pyarrow is required for Parquet export.")
+        path = self._part_path()
+        self.paths.append(path)
+        self.raw = open(path, 'wb')
+
+    def _close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+        else:
+            pa = optional_module('pyarrow')
+            pq = optional_module('pyarrow.parquet')
+            # Nothing was written: still leave a valid file with the known columns
+            schema = self.schema or pa.schema([(str(name), pa.string()) for name in self.columns or []])
+            pq.ParquetWriter(self.raw, schema).close()
+        self.raw.close()
+        self.raw = None
+        self.parquet = None
+
+    def _write_record_batch(self, record_batch):
+        pa = optional_module('pyarrow')
+        pq = optional_module('pyarrow.parquet')
+        if self.raw is None:
+            self._open()
+        if self.parquet is None:
+            if self.schema is None:
+                # Columns that are all NULL in the first chunk are typed as strings
+                self.schema = pa.schema([
+                    pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                    for field in record_batch.schema
+                ])
+            self.parquet = pq.ParquetWriter(self.raw, self.schema, compression=self.compression or 'snappy')
+        self.parquet.write_table(pa.Table.from_batches([record_batch]).cast(self.schema))
+        if self.max_file_size and self.raw.tell() >= self.max_file_size:
+            self._close()
+
+    def write_rows(self, rows):
+        pa = optional_module('pyarrow')
+        for chunk in iter_chunks(rows, BATCH_SIZE):
+            if isinstance(chunk[0], dict):
+                record_batch = pa.RecordBatch.from_pylist(chunk)
+            else:
+                names = self.columns or [f"column{i}" for i in range(len(chunk[0]))]
+                record_batch = pa.RecordBatch.from_arrays([arrow_array(values) for values in zip(*chunk)], names=list(names))
+            self._write_record_batch(record_batch)
+
+    def write_batch(self, batch):
+        self._write_record_batch(batch.to_arrow(self.columns))
+
+    def close(self):
+        if self.raw is None and not self.paths:
+            self._open()
+        if self.raw is not None:
+            self._close()
+
+# Exporters by format name
+EXPORT_WRITERS = {
+    'csv': CsvExportWriter,
+    'json': JsonExportWriter,
+    'jsonl': JsonLinesExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+def iter_chunks(rows, size):
+    """
+    Yields lists of at most size items from any iterable.
+    """
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
+
+def _export(feed, columns, export_format, path=None, compression=None, max_file_size=None, append=False):
+    """
+    Creates the writer for an export, lets feed write to it and reports the files written.
+    """
+    try:
+        export_format, compression = parse_export_format(export_format, compression)
+        writer_class = EXPORT_WRITERS.get(export_format)
+        if writer_class is None:
+            raise ValueError(f"Unsupported export format. Supported formats: {', '.join(EXPORT_WRITERS)}.")
+        path = path or 'output' + export_extension(export_format, compression)
+        initial_size = os.path.getsize(path) if append and os.path.exists(path) else 0
+        writer = writer_class(path, columns, compression, max_file_size, append)
+        # Exports are streamed, so this times the whole pipeline feeding the writer
+        with metrics.timer('export_seconds', format=export_format):
+            try:
+                feed(writer)
+            finally:
+                writer.close()
+        metrics.inc('export_bytes', sum(os.path.getsize(part) for part in writer.paths) - initial_size, format=export_format)
+        print(f"Data exported to {', '.join(writer.paths)}")
+    except Exception as e:
+        # Fetching and decryption run inside feed, so their errors must fail the fetch too
+        logging.error(f"Error exporting data: {e}")
+        raise
+
+def export_batches(batches, columns, export_format, path=None, compression=None, max_file_size=None, append=False, on_written=None):
+    """
+    Exports a stream of RowBatches, writing each batch as it arrives.
+    With on_written, output is flushed after every batch and on_written(batch, writer)
+    is called, e.g. to checkpoint how far the export got.
+    """
+    def feed(writer):
+        for batch in batches:
+            writer.write_batch(batch)
+            if on_written is not None:
+                on_written(batch, writer)
+    _export(feed, columns, export_format, path, compression, max_file_size, append)
+
+def export_data(data, columns, export_format, path=None, compression=None, max_file_size=None):
+    """
+    Exports data to CSV, JSON, JSON Lines or Parquet format, optionally gzip/zstd compressed
+    (e.g. export_format='csv.gz'). Data may be any iterable of rows; it is written in chunks
+    as it is consumed. The output file defaults to output.<extension>.
+    """
+    if isinstance(data, dict):
+        feed = lambda writer: writer.write_object(data)
+    else:
+        feed = lambda writer: writer.write_rows(data)
+    _export(feed, columns, export_format, path, compression, max_file_size)
+
+def load_private_key(private_key_path):
+    """
+    Loads an RSA or ECC private key from a file.
+    """
+    try:
+        with open(private_key_path, "rb") as key_file:
+            private_key = serialization.load_pem_private_key(
+                key_file.read(),
+                password=None,
+                backend=backends.default_backend()
+            )
+            return private_key
+    except Exception as e:
+        logging.error(f"Error loading private key: {e}")
         return None
 
+def load_jobs(jobs_file):
+    """
+    Loads a list of batch jobs from a JSON file.
+    Each job is an object with a db_type, its connection details and a table or query,
+    plus any other fetch_data option (export, output, workers, ...).
+    """
+    with open(jobs_file, 'r') as f:
+        jobs = json.load(f)
+    if not isinstance(jobs, list):
+        raise ValueError("Jobs file must contain a list of jobs.")
+    return jobs
+
+def prepare_job(job, index, **defaults):
+    """
+    Merges a job with the shared options and returns (name, db_type, options, report).
+    """
+    options = dict(defaults)
+    options.update(job)
+    db_type = options.pop('db_type', None)
+    name = options.pop('name', None) or f"job{index}"
+    options.setdefault('preview_rows', 0)
+    options.setdefault('drain', True)
+    report = {'name': name, 'db_type': db_type, 'status': 'ok', 'rows': 0, 'seconds': 0.0, 'rows_per_sec': 0.0, 'error': None}
+    return name, db_type, options, report
+
+def set_job_output(name, options):
+    """
+    Names the export after the job, since concurrent jobs must not share the default output file.
+    """
+    if options.get('export') and not options.get('output'):
+        export_format, compression = parse_export_format(options['export'], options.get('compression'))
+        options['output'] = name + export_extension(export_format, compression)
+
+def finish_report(report, start, error=None):
+    """
+    Records the outcome and timing of a job in its report.
+    """
+    if error is not None:
+        logging.error(f"Job {report['name']} failed: {error}")
+        report['status'] = 'failed'
+        report['error'] = str(error)
+    report['seconds'] = time.perf_counter() - start
+    if report['seconds'] > 0:
+        report['rows_per_sec'] = report['rows'] / report['seconds']
+    return report
+
+def run_job(job, index, **defaults):
+    """
+    Runs one batch job and returns its report.
+    """
+    name, db_type, options, report = prepare_job(job, index, **defaults)
+    start = time.perf_counter()
+    try:
+        set_job_output(name, options)
+        report['rows'] = _fetch_data(db_type, **options)
+    except Exception as e:
+        return finish_report(report, start, e)
+    return finish_report(report, start)
+
+async def run_job_async(job, index, **defaults):
+    """
+    Runs one batch job with fetch_data_async and returns its report.
+    """
+    name, db_type, options, report = prepare_job(job, index, **defaults)
+    start = time.perf_counter()
+    try:
+        set_job_output(name, options)
+        report['rows'] = await fetch_data_async(db_type, **options)
+    except Exception as e:
+        return finish_report(report, start, e)
+    return finish_report(report, start)
+
+def run_jobs(jobs, max_workers=MAX_PARALLEL_JOBS, **defaults):
+    """
+    Runs batch jobs concurrently, at most max_workers at a time.
+    Options in defaults (key, private_key, ...) apply to every job unless the job overrides them.
+    Prints a per-job summary and returns the reports in job order.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_job, job, index, **defaults) for index, job in enumerate(jobs, 1)]
+        reports = [future.result() for future in futures]
+    print_job_reports(reports, time.perf_counter() - start)
+    return reports
+
+def run_jobs_async(jobs, max_workers=MAX_PARALLEL_JOBS, **defaults):
+    """
+    Runs batch jobs on an asyncio event loop, at most max_workers at a time, so fetches from
+    many remote hosts overlap. Prints a per-job summary and returns the reports in job order.
+    """
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def run_one(job, index):
+            async with semaphore:
+                return await run_job_async(job, index, **defaults)
+
+        return await asyncio.gather(*(run_one(job, index) for index, job in enumerate(jobs, 1)))
+
+    start = time.perf_counter()
+    reports = asyncio.run(run_all())
+    print_job_reports(reports, time.perf_counter() - start)
+    return reports
+
+def print_job_reports(reports, elapsed):
+    """
+    Prints the per-job summary table and the totals of a run.
+    """
+    print(tabulate.tabulate(
+        [[r['name'], r['db_type'], r['status'], r['rows'], f"{r['seconds']:.3f}", f"{r['rows_per_sec']:.1f}"] for r in reports],
+        headers=['job', 'type', 'status', 'rows', 'seconds', 'rows/sec'],
+        tablefmt="pretty"
+    ))
+    total_rows = sum(r['rows'] for r in reports)
+    throughput = total_rows / elapsed if elapsed > 0 else 0.0
+    print(f"{len(reports)} jobs, {total_rows} rows in {elapsed:.3f}s ({throughput:.1f} rows/sec)")
+    for r in reports:
+        if r['error']:
+            print(f"{r['name']}: {r['error']}")
+
+def build_parser():
+    """
+    Builds the command-line parser. Options that are not given are left out of the result,
+    so they do not override the config file.
+    """
+    parser = argparse.ArgumentParser(
+        description="View and export encrypted data from databases and JSON files.",
+        argument_default=argparse.SUPPRESS
+    )
+    parser.add_argument('--config', help="JSON config file; command-line options override its settings")
+    source = parser.add_argument_group('source')
+    source.add_argument('--db-type', choices=['sqlite', 'mysql', 'postgresql', 'mssql', 'json'])
+    source.add_argument('--database', help="database name, or the SQLite file path")
+    source.add_argument('--host')
+    source.add_argument('--server', help="MSSQL server")
+    source.add_argument('--user')
+    source.add_argument('--db-password', dest='password')
+    source.add_argument('--db-password-env', dest='password_env', help="environment variable holding the database password")
+    source.add_argument('--file', help="JSON source file")
+    source.add_argument('--table', dest='tables', action='append', help="table to fetch (repeatable)")
+    source.add_argument('--query', dest='queries', action='append', help="custom query to run (repeatable)")
+    source.add_argument('--jobs', dest='jobs_file', help="jobs file (JSON list of jobs)")
+    source.add_argument('--columns', dest='select_columns', type=lambda value: [column.strip() for column in value.split(',')], help="comma-separated columns to fetch in table mode")
+    source.add_argument('--where', help="row filter of table mode, with ? marking each --param value")
+    source.add_argument('--param', dest='params', action='append', help="text value bound to the next ? of --where or --query; the database casts it to the column type (repeatable)")
+    source.add_argument('--limit', type=int, help="maximum rows to fetch per table")
+    keys = parser.add_argument_group('key material')
+    keys.add_argument('--key-password', help="encryption password")
+    keys.add_argument('--key-password-env', help="environment variable holding the encryption password")
+    keys.add_argument('--salt', help="encryption salt")
+    keys.add_argument('--private-key', help="RSA or ECC private key file (PEM)")
+    keys.add_argument('--kdf-iterations', type=int, help=f"PBKDF2 iterations of the key derivation (default {KDF_ITERATIONS})")
+    keys.add_argument('--key-cache', help=f"encrypted on-disk cache of derived keys (secret in ${KEY_CACHE_SECRET_ENV})")
+    output = parser.add_argument_group('output')
+    output.add_argument('--export', help="csv, json, jsonl or parquet, optionally with .gz or .zst")
+    output.add_argument('--output', help="export file path")
+    output.add_argument('--max-file-size', type=int, help="roll over to a new part file after this many bytes")
+    output.add_argument('--preview-rows', type=int, help="rows to print per job (default 0)")
+    output.add_argument('--summary', help="write a JSON run summary to this file ('-' for stdout)")
+    output.add_argument('--metrics-file', help="write the run metrics as JSON to this file")
+    output.add_argument('--prometheus-file', help="write the run metrics in Prometheus text format to this file")
+    tuning = parser.add_argument_group('processing')
+    tuning.add_argument('--batch-size', type=int)
+    tuning.add_argument('--workers', type=int, help="decryption workers per job")
+    tuning.add_argument('--use-processes', action='store_true', help="decrypt in worker processes instead of threads")
+    tuning.add_argument('--max-jobs', type=int, help=f"jobs run in parallel (default {MAX_PARALLEL_JOBS})")
+    tuning.add_argument('--async', dest='async_io', action='store_true', help="run jobs on an asyncio event loop (asyncpg/aiomysql when installed)")
+    tuning.add_argument('--pg-copy', action='store_true', help="stream PostgreSQL rows with COPY instead of a cursor")
+    tuning.add_argument('--partitions', type=int, help="key ranges scanned in parallel per table")
+    tuning.add_argument('--checkpoint', help="checkpoint file for resumable table scans")
+    tuning.add_argument('--incremental', action='store_true', help="only export rows added since the previous run")
+    tuning.add_argument('--state-file', help="high-water mark file of incremental exports")
+    tuning.add_argument('--watermark-column')
+    tuning.add_argument('--plan-columns', action='store_true')
+    tuning.add_argument('--decrypt-cache', action='store_true')
+    tuning.add_argument('--decrypt-cache-size', type=int)
+    return parser
+
+def load_settings(args):
+    """
+    Merges the config file (if any) with the command-line options, which take precedence.
+    """
+    settings = {}
+    options = vars(args)
+    config_file = options.pop('config', None)
+    if config_file:
+        with open(config_file, 'r') as f:
+            settings = json.load(f)
+        if not isinstance(settings, dict):
+            raise ValueError("Config file must contain a JSON object.")
+    settings.update(options)
+    return settings
+
+def resolve_secret(options, name):
+    """
+    Replaces options[name + '_env'] with the value of that environment variable.
+    """
+    variable = options.pop(name + '_env', None)
+    if variable:
+        if variable not in os.environ:
+            raise ValueError(f"Environment variable {variable} is not set.")
+        options[name] = os.environ[variable]
+
+def build_jobs(settings):
+    """
+    Splits the settings into a list of jobs and the options shared by all of them.
+    Jobs come from the config's 'jobs' list, a jobs file, or one job per table/query
+    (or the JSON file) of the configured source.
+    """
+    defaults = dict(settings)
+    jobs = defaults.pop('jobs', None)
+    jobs_file = defaults.pop('jobs_file', None)
+    tables = defaults.pop('tables', None) or ([defaults.pop('table')] if 'table' in defaults else [])
+    queries = defaults.pop('queries', None) or ([defaults.pop('query')] if 'query' in defaults else [])
+    if jobs_file:
+        jobs = load_jobs(jobs_file)
+    if jobs is not None:
+        if not isinstance(jobs, list):
+            raise ValueError("'jobs' must be a list of jobs.")
+        for job in jobs:
+            resolve_secret(job, 'password')
+        return jobs, defaults
+
+    source = {name: defaults.pop(name) for name in SOURCE_OPTIONS if name in defaults}
+    db_type = source.get('db_type')
+    if not db_type:
+        raise ValueError("No database type given (--db-type) and no jobs to run.")
+    if db_type == 'json':
+        if not source.get('file'):
+            raise ValueError("A JSON file is required (--file).")
+        return [dict(source, name=os.path.splitext(os.path.basename(source['file']))[0])], defaults
+    if not tables and not queries:
+        raise ValueError("Either a table (--table) or a custom query (--query) is required.")
+    jobs = [dict(source, name=table, table=table) for table in tables]
+    jobs += [dict(source, name=f"query{index}", query=query) for index, query in enumerate(queries, 1)]
+    return jobs, defaults
+
+def write_summary(summary, path):
+    """
+    Writes the machine-readable run summary to a file, or to stdout for '-'.
+    """
+    if path == '-':
+        print(json.dumps(summary, indent=4))
+        return
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=4)
+
+def cli(argv=None):
+    """
+    Non-interactive entry point: runs the jobs described by the command line and config file
+    and returns the process exit code (EXIT_OK, EXIT_JOB_FAILED or EXIT_USAGE).
+    """
+    args = build_parser().parse_args(argv)
+    try:
+        settings = load_settings(args)
+        resolve_secret(settings, 'password')
+        resolve_secret(settings, 'key_password')
+        key_password = settings.pop('key_password', None)
+        salt = settings.pop('salt', None)
+        kdf_iterations = settings.pop('kdf_iterations', None)
+        key_cache = settings.pop('key_cache', None)
+        private_key_path = settings.pop('private_key', None)
+        summary_path = settings.pop('summary', None)
+        metrics_path = settings.pop('metrics_file', None)
+        prometheus_path = settings.pop('prometheus_file', None)
+        max_jobs = settings.pop('max_jobs', MAX_PARALLEL_JOBS)
+        runner = run_jobs_async if settings.pop('async_io', False) else run_jobs
+        jobs, defaults = build_jobs(settings)
+        if defaults.get('output') and len(jobs) > 1:
+            raise ValueError("An output path (--output) can only be used with a single job.")
+        if key_password is not None and salt is None:
+            raise ValueError("An encryption salt (--salt) is required with the encryption password.")
+        if key_cache:
+            # Fail before any job runs rather than on every derivation
+            _key_cache_secret()
+        defaults['key'] = derive_key(key_password, salt.encode(), kdf_iterations, key_cache) if key_password is not None else None
+        if private_key_path:
+            defaults['private_key'] = load_private_key(private_key_path)
+            if defaults['private_key'] is None:
+                raise ValueError(f"Could not load private key {private_key_path}.")
+    except (OSError, ValueError) as e:
+        logging.error(f"Invalid configuration: {e}")
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    start = time.perf_counter()
+    if summary_path == '-':
+        # Keep stdout for the summary
+        with redirect_stdout(sys.stderr):
+            reports = runner(jobs, max_jobs, **defaults)
+    else:
+        reports = runner(jobs, max_jobs, **defaults)
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for r in reports if r['status'] != 'ok')
+    total_rows = sum(r['rows'] for r in reports)
+    summary = {
+        'status': 'failed' if failed else 'ok',
+        'started_at': started_at,
+        'seconds': elapsed,
+        'jobs': len(reports),
+        'failed': failed,
+        'rows': total_rows,
+        'rows_per_sec': total_rows / elapsed if elapsed > 0 else 0.0,
+        'reports': reports,
+        'metrics': metrics.summary(),
+    }
+    if summary_path:
+        write_summary(summary, summary_path)
+    if metrics_path:
+        write_metrics(metrics_path)
+    if prometheus_path:
+        write_prometheus(prometheus_path)
+    return EXIT_JOB_FAILED if failed else EXIT_OK
+
 def main():
-    db_type = input("Enter database type (sqlite, mysql, postgresql, mssql, json): ").strip().lower()
-    if db_type not in ['sqlite', 'mysql', 'postgresql', 'mssql', 'json']:
+    db_type = input("Enter database type (sqlite, mysql, postgresql, mssql, json, batch): ").strip().lower()
+    if db_type not in ['sqlite', 'mysql', 'postgresql', 'mssql', 'json', 'batch']:
         print("Unsupported database type.")
         return
 
@@ -458,6 +3256,12 @@ def main():
         private_key_path = input("Enter the path to the private key file: ").strip()
         private_key = load_private_key(private_key_path)
 
+    if db_type == 'batch':
+        jobs_file = input("Enter jobs file path: ").strip()
+        max_workers = input(f"Enter the number of jobs to run in parallel (default {MAX_PARALLEL_JOBS}): ").strip()
+        run_jobs(load_jobs(jobs_file), int(max_workers) if max_workers else MAX_PARALLEL_JOBS, key=key, private_key=private_key)
+        return
+
     if db_type == 'sqlite':
         database_file = input("Enter SQLite database file path: ").strip()
         tables = fetch_tables(db_type, database=database_file)
@@ -470,10 +3274,10 @@ def main():
         table_choice = input("Enter the number of the table to fetch data from (or leave blank to use custom query): ").strip()
         if table_choice:
             table_name = tables[int(table_choice) - 1]
-            fetch_data(db_type, database=database_file, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, database=database_file, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
         else:
             query = input("Enter custom query: ").strip()
-            fetch_data(db_type, database=database_file, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, database=database_file, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
 
     elif db_type == 'mysql':
         host = input("Enter MySQL host: ").strip()
@@ -490,10 +3294,10 @@ def main():
         table_choice = input("Enter the number of the table to fetch data from (or leave blank to use custom query): ").strip()
         if table_choice:
             table_name = tables[int(table_choice) - 1]
-            fetch_data(db_type, host=host, user=user, password=password_db, database=database, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, host=host, user=user, password=password_db, database=database, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
         else:
             query = input("Enter custom query: ").strip()
-            fetch_data(db_type, host=host, user=user, password=password_db, database=database, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, host=host, user=user, password=password_db, database=database, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
 
     elif db_type == 'postgresql':
         host = input("Enter PostgreSQL host: ").strip()
@@ -510,10 +3314,10 @@ def main():
         table_choice = input("Enter the number of the table to fetch data from (or leave blank to use custom query): ").strip()
         if table_choice:
             table_name = tables[int(table_choice) - 1]
-            fetch_data(db_type, host=host, user=user, password=password_db, database=database, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, host=host, user=user, password=password_db, database=database, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
         else:
             query = input("Enter custom query: ").strip()
-            fetch_data(db_type, host=host, user=user, password=password_db, database=database, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, host=host, user=user, password=password_db, database=database, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
 
     elif db_type == 'mssql':
         server = input("Enter MSSQL server: ").strip()
@@ -530,14 +3334,17 @@ def main():
         table_choice = input("Enter the number of the table to fetch data from (or leave blank to use custom query): ").strip()
         if table_choice:
             table_name = tables[int(table_choice) - 1]
-            fetch_data(db_type, server=server, user=user, password=password_db, database=database, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, server=server, user=user, password=password_db, database=database, table=table_name, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
         else:
             query = input("Enter custom query: ").strip()
-            fetch_data(db_type, server=server, user=user, password=password_db, database=database, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+            fetch_data(db_type, server=server, user=user, password=password_db, database=database, query=query, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
 
     elif db_type == 'json':
         json_file = input("Enter JSON file path: ").strip()
-        fetch_data(db_type, file=json_file, key=key, private_key=private_key, export=input("Export data to (csv/json) or leave blank: ").strip())
+        fetch_data(db_type, file=json_file, key=key, private_key=private_key, export=input("Export data to (csv/json/jsonl/parquet, add .gz or .zst to compress) or leave blank: ").strip())
 
 if __name__ == "__main__":
+    # Any argument switches to the non-interactive command line
+    if len(sys.argv) > 1:
+        sys.exit(cli())
     main()
\ No newline at end of file
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+@pytest.fixture
+def key():
+    return os.urandom(32)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    # Pools and metrics are process-wide; every test starts without them
+    yield
+    main.close_pools()
+    main.metrics.reset()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import main
+
+
+def test_engine_closes_off_the_event_loop(tmp_path, key, monkeypatch):
+    database = tmp_path / 'data.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE items (name TEXT)")
+    conn.executemany("INSERT INTO items VALUES (?)", [(f"n{i}",) for i in range(50)])
+    conn.commit()
+    conn.close()
+    close = main.DecryptionEngine.close
+    threads = []
+
+    def record_thread(engine):
+        threads.append(threading.current_thread())
+        close(engine)
+
+    monkeypatch.setattr(main.DecryptionEngine, 'close', record_thread)
+    rows = asyncio.run(main.fetch_data_async(
+        'sqlite', database=str(database), table='items', key=key, export='csv',
+        output=str(tmp_path / 'out.csv'), preview_rows=0, batch_size=10, workers=2
+    ))
+
+    assert rows == 50
+    assert threads and threading.main_thread() not in threads
+
+
+# Runs more async jobs than the pool has connections in a fresh interpreter, so a deadlock
+# fails the test on the timeout instead of hanging the test run
+MANY_JOBS_SCRIPT = """
+import os, sys
+sys.path.insert(0, sys.argv[1])
+import main
+jobs = [{'name': f"job{i}", 'db_type': 'sqlite', 'database': sys.argv[2], 'table': 'items'} for i in range(int(sys.argv[3]))]
+reports = main.run_jobs_async(jobs, len(jobs), key=os.urandom(32), preview_rows=0, batch_size=10, pool_size=2)
+print([report['status'] for report in reports])
+"""
+
+
+def test_more_async_jobs_than_pool_slots_finish(tmp_path):
+    database = tmp_path / 'data.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE items (name TEXT)")
+    conn.executemany("INSERT INTO items VALUES (?)", [(f"n{i}",) for i in range(200)])
+    conn.commit()
+    conn.close()
+    jobs = 40
+
+    result = subprocess.run(
+        [sys.executable, '-c', MANY_JOBS_SCRIPT, os.path.dirname(os.path.dirname(os.path.abspath(__file__))), str(database), str(jobs)],
+        capture_output=True, text=True, timeout=60
+    )
+
+    assert result.stdout.splitlines()[-1] == str(['ok'] * jobs)
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import main
+from test_export import write_broken_json_array
+
+
+def write_json_records(path, records):
+    with open(path, 'w') as f:
+        json.dump([{'id': i, 'name': f"n{i}"} for i in range(records)], f)
+
+
+def run_cli(tmp_path, source, *extra):
+    summary = tmp_path / 'summary.json'
+    code = main.cli([
+        '--db-type', 'json', '--file', str(source), '--key-password', 'pw', '--salt', 'salt',
+        '--export', 'csv', '--output', str(tmp_path / 'out.csv'), '--batch-size', '100',
+        '--summary', str(summary), *extra
+    ])
+    return code, json.loads(summary.read_text())
+
+
+@pytest.fixture(autouse=True)
+def fast_kdf(monkeypatch):
+    monkeypatch.setattr(main, 'derive_key', lambda password, salt, *args, **kwargs: b'k' * 32)
+
+
+@pytest.mark.parametrize('extra', [(), ('--async',)])
+def test_successful_job_exits_ok(tmp_path, extra):
+    source = tmp_path / 'data.json'
+    write_json_records(source, 250)
+
+    code, summary = run_cli(tmp_path, source, *extra)
+
+    assert code == main.EXIT_OK
+    assert summary['status'] == 'ok'
+    assert summary['rows'] == 250
+
+
+@pytest.mark.parametrize('extra', [(), ('--async',)])
+def test_stream_error_mid_export_exits_job_failed(tmp_path, extra):
+    source = tmp_path / 'broken.json'
+    write_broken_json_array(source, 3000)
+
+    code, summary = run_cli(tmp_path, source, *extra)
+
+    assert code == main.EXIT_JOB_FAILED
+    assert summary['status'] == 'failed'
+    assert summary['reports'][0]['status'] == 'failed'
+
+
+def test_invalid_options_exit_usage(tmp_path):
+    assert main.cli(['--db-type', 'json', '--file', str(tmp_path / 'x.json'), '--key-password', 'pw']) == main.EXIT_USAGE
+
+
+def test_key_cache_without_secret_is_a_usage_error(tmp_path, monkeypatch):
+    monkeypatch.delenv(main.KEY_CACHE_SECRET_ENV, raising=False)
+    source = tmp_path / 'data.json'
+    write_json_records(source, 1)
+
+    code = main.cli([
+        '--db-type', 'json', '--file', str(source), '--key-password', 'pw', '--salt', 'salt',
+        '--key-cache', str(tmp_path / 'keys.json')
+    ])
+
+    assert code == main.EXIT_USAGE
+
+
+def test_kdf_options_reach_derive_key(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, 'derive_key', lambda *args: calls.append(args) or b'k' * 32)
+    monkeypatch.setenv(main.KEY_CACHE_SECRET_ENV, 'secret')
+    source = tmp_path / 'data.json'
+    write_json_records(source, 1)
+
+    run_cli(tmp_path, source, '--kdf-iterations', '1000', '--key-cache', str(tmp_path / 'keys.json'))
+
+    assert calls == [('pw', b'salt', 1000, str(tmp_path / 'keys.json'))]
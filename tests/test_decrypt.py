@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import zlib
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import main
+from benchmark import OAEP, encrypt_aes, encrypt_envelope
+
+
+@pytest.fixture(scope='module')
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def cells_decrypted():
+    return {entry['labels']['algorithm']: entry['value'] for entry in main.metrics.summary()['counters'].get('cells_decrypted', [])}
+
+
+def test_row_batch_decrypts_and_counts_cells_once_per_batch(key):
+    decryptor = main.Decryptor(key)
+    rows = [(i, encrypt_aes(zlib.compress(f"value-{i}".encode()), key)) for i in range(50)]
+
+    batch = main.RowBatch.from_rows(rows, decryptor)
+
+    assert [row[1] for row in batch.rows()] == [f"value-{i}" for i in range(50)]
+    assert cells_decrypted() == {'aes': 50, 'zlib': 50}
+    assert not decryptor.tallies.chains
+
+
+def test_counts_are_kept_per_thread_until_flushed(key):
+    decryptor = main.Decryptor(key)
+    decryptor.decrypt(encrypt_aes(zlib.compress(b"x"), key))
+    assert cells_decrypted() == {}
+    decryptor.flush_counts()
+    assert cells_decrypted() == {'aes': 1, 'zlib': 1}
+
+
+def engine_counters(key, rows, use_processes, cache_size=0):
+    main.metrics.reset()
+    decryptor = main.Decryptor(key, cache_size=cache_size)
+    with main.DecryptionEngine(decryptor, workers=2, chunk_size=10, use_processes=use_processes) as engine:
+        values = [row[1:] for batch in engine.decrypt_stream([rows]) for row in batch.rows()]
+    decryptor.log_cache_stats()
+    return values, main.metrics.counter_values()
+
+
+def test_worker_processes_report_the_same_counts_as_threads(key):
+    rows = [(i, encrypt_aes(zlib.compress(f"value-{i}".encode()), key), b'\x00not text') for i in range(40)]
+
+    in_threads = engine_counters(key, rows, use_processes=False)
+    in_processes = engine_counters(key, rows, use_processes=True)
+
+    assert in_processes == in_threads
+    assert in_processes[1][('cells_decrypted', (('algorithm', 'aes'),))] == 40
+
+
+def test_worker_process_cache_counts_reach_the_parent(key):
+    cell = encrypt_aes(zlib.compress(b"same"), key)
+    rows = [(i, cell) for i in range(40)]
+
+    values, counters = engine_counters(key, rows, use_processes=True, cache_size=main.DECRYPT_CACHE_SIZE)
+
+    assert values == [('same',)] * 40
+    hits = counters[('cache_hits', (('cache', 'decrypted-value'),))]
+    misses = counters[('cache_misses', (('cache', 'decrypted-value'),))]
+    # One miss per worker process that got a chunk
+    assert hits + misses == 40
+    assert misses in (1, 2)
+
+
+def test_planned_decryptor_learns_a_column_plan_from_its_samples(key, monkeypatch):
+    decryptor = main.PlannedDecryptor(key, sample_size=3)
+    cells = [encrypt_aes(zlib.compress(f"value-{i}".encode()), key) for i in range(5)]
+
+    assert [decryptor.decrypt_cell(1, cell) for cell in cells[:3]] == ['value-0', 'value-1', 'value-2']
+    assert decryptor.plans == {1: ('aes', 'zlib')}
+    assert decryptor.samples == {}
+
+    # Once planned, cells only go through the learned chain
+    monkeypatch.setattr(decryptor, 'probe', None)
+    assert [decryptor.decrypt_cell(1, cell) for cell in cells[3:]] == ['value-3', 'value-4']
+
+
+def test_planned_decryptor_marks_disagreeing_samples_as_mixed(key):
+    decryptor = main.PlannedDecryptor(key, sample_size=2)
+    encrypted = encrypt_aes(zlib.compress(b"secret"), key)
+    compressed = zlib.compress(b"plain")
+
+    assert decryptor.decrypt_cell(0, encrypted) == 'secret'
+    assert decryptor.decrypt_cell(0, compressed) == 'plain'
+    assert decryptor.plans == {0: main.MIXED}
+    assert decryptor.decrypt_cell(0, compressed) == 'plain'
+    assert decryptor.decrypt_cell(0, encrypted) == 'secret'
+
+
+def test_planned_decryptor_probes_cells_that_do_not_fit_the_plan(key):
+    decryptor = main.PlannedDecryptor(key, sample_size=2)
+    for i in range(2):
+        decryptor.decrypt_cell(0, encrypt_aes(zlib.compress(f"value-{i}".encode()), key))
+    uncompressed = encrypt_aes(b"not compressed", key)
+
+    assert decryptor.apply_chain(uncompressed, decryptor.plans[0]) is main.NO_FIT
+    assert decryptor.decrypt_cell(0, uncompressed) == 'not compressed'
+    assert decryptor.plans == {0: ('aes', 'zlib')}
+
+
+def test_decrypt_cache_evicts_least_recently_used_values():
+    entry_size = sys.getsizeof('value-0') + main.CACHE_ENTRY_OVERHEAD
+    cache = main.DecryptCache(max_bytes=2 * entry_size)
+    digests = [cache.digest(f"cell-{i}".encode()) for i in range(3)]
+
+    cache.put(digests[0], 'value-0')
+    cache.put(digests[1], 'value-1')
+    assert cache.get(digests[0]) == (True, 'value-0')
+    cache.put(digests[2], 'value-2')
+
+    assert cache.get(digests[1]) == (False, None)
+    assert cache.get(digests[0]) == (True, 'value-0')
+    assert cache.get(digests[2]) == (True, 'value-2')
+    assert cache.size <= cache.max_bytes
+
+
+def test_uncached_columns_skip_the_cache_by_index_and_by_name(key):
+    cell = encrypt_aes(zlib.compress(b"same"), key)
+    rows = [(cell, cell, cell)] * 3
+
+    by_index = main.Decryptor(key, cache_size=main.DECRYPT_CACHE_SIZE, uncached_columns=[1])
+    by_name = main.Decryptor(key, cache_size=main.DECRYPT_CACHE_SIZE, uncached_columns=['notes'])
+    by_name.set_columns(['id', 'notes', 'name'])
+
+    for decryptor in (by_index, by_name):
+        batch = main.RowBatch.from_rows(rows, decryptor)
+        assert list(batch.rows()) == [('same', 'same', 'same')] * 3
+        # Columns 0 and 2 share one cached value; column 1 never looks it up
+        assert (decryptor.cache.hits, decryptor.cache.misses) == (5, 1)
+
+
+def test_parse_envelope_rejects_short_and_truncated_cells(key, private_key):
+    decryptor = main.Decryptor(key, private_key)
+    wrapped_key = private_key.public_key().encrypt(os.urandom(32), OAEP)
+    cell = encrypt_envelope(b"value", os.urandom(32), wrapped_key)
+
+    flags, parsed_key, iv, payload = decryptor.parse_envelope(cell)
+    assert (flags, parsed_key, len(iv)) == (main.ENVELOPE_ZLIB, wrapped_key, 16)
+    assert payload == cell[-len(payload):]
+    header = len(main.ENVELOPE_MAGIC) + 3
+    invalid = [
+        cell[:header - 1],                        # Short of the key length
+        cell[:header + len(wrapped_key) + 15],    # Cut inside the IV
+        b'X' + cell[1:],                          # Wrong magic
+    ]
+    for data in invalid:
+        assert decryptor.parse_envelope(data) is None
+        assert decryptor.decrypt_envelope(data) is None
+
+
+def test_envelope_data_keys_are_unwrapped_once_per_wrapped_key(key, private_key, monkeypatch):
+    decryptor = main.Decryptor(key, private_key)
+    data_keys = [os.urandom(32) for _ in range(2)]
+    wrapped_keys = [private_key.public_key().encrypt(data_key, OAEP) for data_key in data_keys]
+    cells = [encrypt_envelope(f"value-{i}".encode(), data_keys[i % 2], wrapped_keys[i % 2]) for i in range(6)]
+    unwrapped = []
+    decrypt_rsa = decryptor.decrypt_rsa
+    monkeypatch.setattr(decryptor, 'decrypt_rsa', lambda data: unwrapped.append(data) or decrypt_rsa(data))
+
+    assert [decryptor.decrypt(cell) for cell in cells] == [f"value-{i}" for i in range(6)]
+    assert unwrapped == wrapped_keys
+
+
+def test_envelope_payload_is_decompressed_only_with_the_zlib_flag(key, private_key):
+    decryptor = main.Decryptor(key, private_key)
+    data_key = os.urandom(32)
+    wrapped_key = private_key.public_key().encrypt(data_key, OAEP)
+    compressed = encrypt_envelope(b"value", data_key, wrapped_key)
+    raw = encrypt_envelope(zlib.compress(b"value"), data_key, wrapped_key, compress=False)
+
+    assert compressed[len(main.ENVELOPE_MAGIC)] == main.ENVELOPE_ZLIB
+    assert raw[len(main.ENVELOPE_MAGIC)] == 0
+    assert decryptor.decrypt_envelope(compressed) == b"value"
+    assert decryptor.decrypt_envelope(raw) == zlib.compress(b"value")
+
+
+def test_engine_keeps_row_order_when_later_chunks_finish_first(key, monkeypatch):
+    decryptor = main.Decryptor(key)
+    rows = [(i, encrypt_aes(zlib.compress(f"value-{i}".encode()), key)) for i in range(40)]
+    finished = []
+    decrypt_cell = decryptor.decrypt_cell
+
+    def slow_first_chunk(column, cell):
+        value = decrypt_cell(column, cell)
+        if value == 'value-0':
+            time.sleep(0.2)
+        finished.append(value)
+        return value
+
+    monkeypatch.setattr(decryptor, 'decrypt_cell', slow_first_chunk)
+    with main.DecryptionEngine(decryptor, workers=4, chunk_size=5) as engine:
+        # Uneven fetch batches also give short chunks at each batch end
+        values = [row for batch in engine.decrypt_stream([rows[:12], rows[12:19], rows[19:]]) for row in batch.rows()]
+
+    assert finished.index('value-0') > finished.index('value-5')
+    assert values == [(i, f"value-{i}") for i in range(40)]
@@ -0,0 +1,60 @@
+import json
+
+import main
+
+
+def write_broken_json_array(path, records):
+    # A JSON array that becomes malformed after `records` records
+    with open(path, 'w') as f:
+        f.write('[')
+        f.write(','.join(json.dumps({'id': i, 'name': f"n{i}"}) for i in range(records)))
+        f.write(', {"id": oops}]')
+
+
+def test_stream_error_during_export_fails_fetch(tmp_path, key):
+    source = tmp_path / 'broken.json'
+    output = tmp_path / 'out.csv'
+    write_broken_json_array(source, 3000)
+
+    rows = main.fetch_data('json', file=str(source), key=key, export='csv', output=str(output), preview_rows=0, batch_size=100)
+
+    assert rows is None
+
+
+def test_export_rows(tmp_path):
+    output = tmp_path / 'out.csv'
+    main.export_data([(1, 'a'), (2, 'b')], ['id', 'name'], 'csv', str(output))
+    assert output.read_text().splitlines() == ['id,name', '1,a', '2,b']
+
+
+PNG = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR'
+
+
+def test_json_export_encodes_bytes_as_base64(tmp_path):
+    output = tmp_path / 'out.json'
+    main.export_data([(1, PNG), (2, 'text')], ['id', 'image'], 'json', str(output))
+    assert json.loads(output.read_text()) == [[1, 'iVBORw0KGgoAAAANSUhEUg=='], [2, 'text']]
+
+
+def test_jsonl_export_encodes_bytes_as_base64(tmp_path):
+    output = tmp_path / 'out.jsonl'
+    main.export_data([(1, PNG)], ['id', 'image'], 'jsonl', str(output))
+    assert [json.loads(line) for line in output.read_text().splitlines()] == [{'id': 1, 'image': 'iVBORw0KGgoAAAANSUhEUg=='}]
+
+
+def test_json_export_without_rows_is_an_empty_array(tmp_path):
+    output = tmp_path / 'out.json'
+    main.export_data([], ['id'], 'json', str(output))
+    assert json.loads(output.read_text()) == []
+
+
+def test_csv_export_reports_fields_missing_from_header(tmp_path, key, caplog):
+    source = tmp_path / 'data.json'
+    source.write_text(json.dumps([{'id': 1}, {'id': 2}, {'id': 3, 'extra': 'x'}]))
+    output = tmp_path / 'out.csv'
+
+    rows = main.fetch_data('json', file=str(source), key=key, export='csv', output=str(output), preview_rows=0, batch_size=2)
+
+    assert rows == 3
+    assert output.read_text().split() == ['id', '1', '2', '3']
+    assert "no column for fields extra" in caplog.text
@@ -0,0 +1,20 @@
+import pytest
+
+import main
+
+
+def test_lazy_module_imports_on_first_use_and_caches_attributes():
+    lazy = main.LazyModule('json')
+    assert 'dumps' not in vars(lazy)
+    assert lazy.dumps([1]) == '[1]'
+    assert 'dumps' in vars(lazy)
+
+
+def test_load_driver_names_the_missing_package(monkeypatch):
+    monkeypatch.setitem(main.BACKEND_DRIVERS, 'mssql', ('no_such_driver_module', 'no-such-driver'))
+    with pytest.raises(ImportError, match="mssql backend requires the no-such-driver package"):
+        main.load_driver('mssql')
+
+
+def test_optional_module_is_none_when_missing():
+    assert main.optional_module('no_such_optional_module') is None
@@ -0,0 +1,60 @@
+import io
+import json
+
+import pytest
+
+import main
+
+
+def read_array(text, chunk_size):
+    return list(main._read_json_array(io.BytesIO(text.encode()), chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1 << 20])
+def test_read_json_array(chunk_size):
+    records = [{'id': 1, 'name': 'é'}, 12345, [1, 2], 'text', None, 1.5e10]
+    assert read_array(json.dumps(records, ensure_ascii=False), chunk_size) == records
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '\n[\n]\n'])
+def test_read_empty_json_array(text):
+    assert read_array(text, 1) == []
+
+
+@pytest.mark.parametrize('text, error', [
+    ('{"id": 1}', "must contain an array"),
+    ('[1, 2', "Unexpected end"),
+    ('[1 2]', "Unexpected character"),
+    ('[1, oops]', "Expecting value"),
+])
+def test_read_malformed_json_array(text, error):
+    with pytest.raises(ValueError, match=error):
+        read_array(text, 2)
+
+
+class CountingReader(io.BytesIO):
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_malformed_element_fails_without_reading_ahead():
+    source = CountingReader(b'[1, oops, ' + b'2, ' * 1000000 + b'3]')
+
+    with pytest.raises(ValueError, match="at character 4: Expecting value"):
+        list(main._read_json_array(source, 1024))
+    assert source.bytes_read == 1024
+
+
+def test_error_position_counts_from_start_of_file():
+    with pytest.raises(ValueError, match="at character 30: Expecting value"):
+        read_array('[{"id": 1}, {"id": 2}, {"id": }]', 4)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7])
+def test_long_strings_span_chunks(chunk_size):
+    records = [{'text': 'x' * 100 + '\\u00e9'}, 'y' * 50]
+    assert read_array(json.dumps(records), chunk_size) == records
@@ -0,0 +1,47 @@
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def empty_key_cache(monkeypatch):
+    monkeypatch.setattr(main, '_key_cache', {})
+
+
+def test_derive_key_reads_settings_at_call_time(monkeypatch):
+    default = main.derive_key('pw', b'salt')
+    monkeypatch.setattr(main, '_key_cache', {})
+    monkeypatch.setattr(main, 'KDF_ITERATIONS', 1000)
+
+    assert main.derive_key('pw', b'salt') != default
+    assert main.derive_key('pw', b'salt') == main.derive_key('pw', b'salt', iterations=1000)
+
+
+def test_key_cache_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv(main.KEY_CACHE_SECRET_ENV, 'cache secret')
+    cache_file = str(tmp_path / 'keys.json')
+    monkeypatch.setattr(main, 'KEY_CACHE_FILE', cache_file)
+
+    key = main.derive_key('pw', b'salt', iterations=1000)
+
+    assert main.load_cached_key(cache_file, 'pw', b'salt', 1000) == key
+    assert not list(tmp_path.glob('*.secret'))
+    assert key not in (tmp_path / 'keys.json').read_bytes()
+
+
+def test_key_cache_needs_secret(tmp_path, monkeypatch):
+    monkeypatch.delenv(main.KEY_CACHE_SECRET_ENV, raising=False)
+    cache_file = str(tmp_path / 'keys.json')
+
+    main.derive_key('pw', b'salt', iterations=1000, cache_file=cache_file)
+
+    assert not (tmp_path / 'keys.json').exists()
+
+
+def test_key_cache_with_wrong_secret_is_ignored(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / 'keys.json')
+    monkeypatch.setenv(main.KEY_CACHE_SECRET_ENV, 'one')
+    main.derive_key('pw', b'salt', iterations=1000, cache_file=cache_file)
+    monkeypatch.setenv(main.KEY_CACHE_SECRET_ENV, 'two')
+
+    assert main.load_cached_key(cache_file, 'pw', b'salt', 1000) is None
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+class FakeConnection:
+    def __init__(self, fail_commit=False):
+        self.fail_commit = fail_commit
+        self.closed = False
+
+    def commit(self):
+        if self.fail_commit:
+            raise RuntimeError("connection lost")
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(size=2, idle_timeout=60, **connection_options):
+    opened = []
+
+    def factory():
+        opened.append(FakeConnection(**connection_options))
+        return opened[-1]
+
+    return main.ConnectionPool(factory, size, idle_timeout), opened
+
+
+def test_pool_reuses_released_connections():
+    pool, opened = make_pool()
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert len(opened) == 1
+    assert not first.closed
+
+
+def test_pool_blocks_once_size_connections_are_checked_out():
+    pool, opened = make_pool(size=2)
+    held = [pool.acquire(), pool.acquire()]
+    acquired = threading.Event()
+
+    def waiter():
+        conn = pool.acquire()
+        acquired.set()
+        pool.release(conn)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not acquired.wait(0.1)
+
+    pool.release(held.pop())
+    assert acquired.wait(5)
+    thread.join(5)
+    assert len(opened) == 2
+
+
+def test_pool_closes_connections_idle_longer_than_the_timeout():
+    pool, opened = make_pool(idle_timeout=0.01)
+    stale = pool.acquire()
+    pool.release(stale)
+    time.sleep(0.05)
+
+    fresh = pool.acquire()
+
+    assert fresh is not stale
+    assert stale.closed
+    assert not pool.idle
+
+
+def test_pool_discards_connections_that_fail():
+    pool, opened = make_pool(size=1)
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("query failed")
+
+    assert opened[0].closed
+    assert not pool.idle
+    # The slot is free again and a new connection is opened
+    with pool.connection() as conn:
+        assert conn is opened[1]
+
+
+def test_pool_discards_connections_whose_transaction_cannot_end():
+    pool, opened = make_pool(size=1, fail_commit=True)
+    with pool.connection():
+        pass
+
+    assert opened[0].closed
+    assert not pool.idle
+    assert pool.slots.acquire(blocking=False)
@@ -0,0 +1,125 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('db_type, expected', [
+    ('sqlite', 'SELECT "id", "name" FROM "main"."order items" WHERE id > ? LIMIT 5'),
+    ('postgresql', 'SELECT "id", "name" FROM "main"."order items" WHERE id > %s LIMIT 5'),
+    ('mysql', 'SELECT `id`, `name` FROM `main`.`order items` WHERE id > %s LIMIT 5'),
+    ('mssql', 'SELECT TOP (5) [id], [name] FROM [main].[order items] WHERE id > ?'),
+])
+def test_build_table_query_quotes_identifiers(db_type, expected):
+    query, params = main.build_table_query(db_type, 'main.order items', ['id', 'name'], 'id > ?', [3], 5)
+    assert (query, params) == (expected, [3])
+
+
+def test_build_table_query_without_options():
+    assert main.build_table_query('mysql', 'items') == ('SELECT * FROM `items`', None)
+
+
+def test_table_query_runs_on_table_with_reserved_name(tmp_path, key):
+    database = tmp_path / 'data.db'
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE TABLE "order" (name TEXT)')
+    conn.execute('INSERT INTO "order" VALUES (\'a\')')
+    conn.commit()
+    conn.close()
+
+    rows = main.fetch_data('sqlite', database=str(database), table='order', key=key, export='csv', output=str(tmp_path / 'out.csv'))
+
+    assert rows == 1
+
+
+@pytest.mark.parametrize('db_type, has_params, paramstyle, expected', [
+    ('sqlite', True, None, "name LIKE 'a%' AND id > ?"),
+    ('mssql', True, None, "name LIKE 'a%' AND id > ?"),
+    ('mysql', True, None, "name LIKE 'a%%' AND id > %s"),
+    ('postgresql', True, None, "name LIKE 'a%%' AND id > %s"),
+    ('postgresql', False, None, "name LIKE 'a%' AND id > ?"),
+    ('postgresql', True, 'numeric', "name LIKE 'a%' AND id > $1"),
+])
+def test_bind_placeholders(db_type, has_params, paramstyle, expected):
+    assert main.bind_placeholders("name LIKE 'a%' AND id > ?", db_type, has_params, paramstyle) == expected
+
+
+def test_bind_placeholders_numbers_each_marker():
+    assert main.bind_placeholders("a = ? OR b = ?", 'postgresql', True, 'numeric') == "a = $1 OR b = $2"
+
+
+@pytest.mark.parametrize('db_type, paramstyle, expected', [
+    ('sqlite', None, "SELECT * FROM items WHERE id = ? AND name LIKE 'a%'"),
+    ('mysql', None, "SELECT * FROM items WHERE id = %s AND name LIKE 'a%%'"),
+    ('postgresql', 'numeric', "SELECT * FROM items WHERE id = $1 AND name LIKE 'a%'"),
+])
+def test_custom_query_markers_follow_the_driver(db_type, paramstyle, expected):
+    query = "SELECT * FROM items WHERE id = ? AND name LIKE 'a%'"
+    assert main.select_query(db_type, paramstyle, query=query, params=['3']) == (expected, ['3'])
+
+
+def test_custom_query_without_params_runs_as_written():
+    query = "SELECT * FROM items WHERE name LIKE 'a%'"
+    assert main.select_query('mysql', query=query) == (query, None)
+
+
+def test_custom_query_binds_params(tmp_path, key):
+    database = tmp_path / 'data.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE items (id INTEGER, name TEXT)")
+    conn.executemany("INSERT INTO items VALUES (?, ?)", [(1, 'a'), (2, 'b'), (3, 'c')])
+    conn.commit()
+    conn.close()
+    output = tmp_path / 'out.csv'
+
+    rows = main.fetch_data('sqlite', database=str(database), query="SELECT name FROM items WHERE id >= ?", params=['2'], key=key, export='csv', output=str(output))
+
+    assert rows == 2
+    assert output.read_text().split() == ['name', 'b', 'c']
+
+
+class ParameterType:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_coerce_asyncpg_params():
+    types = [ParameterType(name) for name in ('int4', 'numeric', 'bool', 'timestamp', 'text', 'int8')]
+    params = ['10', '1.50', 'true', '2024-01-02 03:04:05', 'x', 7]
+
+    assert main.coerce_asyncpg_params(params, types) == [
+        10, main.Decimal('1.50'), True, main.datetime.datetime(2024, 1, 2, 3, 4, 5), 'x', 7
+    ]
+
+
+class RecordingCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchall(self):
+        return self.rows
+
+
+class RecordingConnection:
+    def __init__(self, rows):
+        self.cursor_ = RecordingCursor(rows)
+
+    def cursor(self):
+        return self.cursor_
+
+
+def test_postgres_scan_key_quotes_mixed_case_tables():
+    conn = RecordingConnection([('OrderId',)])
+
+    assert main.PostgresBackend().scan_key(conn, 'Sales.Orders') == 'OrderId'
+    assert conn.cursor_.executed[0][1] == ('"Sales"."Orders"',)
+
+
+def test_scan_key_needs_a_single_column_key():
+    with pytest.raises(ValueError, match="single-column primary key"):
+        main.PostgresBackend().scan_key(RecordingConnection([('a',), ('b',)]), 'items')
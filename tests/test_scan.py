@@ -0,0 +1,183 @@
+import csv
+import datetime
+import decimal
+import json
+import sqlite3
+import uuid
+
+import pytest
+
+import main
+
+
+def create_table(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (name TEXT, created TEXT)")
+    conn.executemany("INSERT INTO items VALUES (?, ?)", [(f"n{i}", f"2024-01-{i % 28 + 1:02d}") for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def exported_names(path):
+    with open(path, newline='') as f:
+        return [row['name'] for row in csv.DictReader(f)]
+
+
+def scan(database, output, checkpoint, **options):
+    return main.fetch_data(
+        'sqlite', database=str(database), table='items', export='csv', output=str(output),
+        checkpoint=str(checkpoint), batch_size=10, preview_rows=0, **options
+    )
+
+
+def test_checkpointed_scan_resumes_after_failure(tmp_path, key, monkeypatch):
+    database, output, checkpoint = tmp_path / 'data.db', tmp_path / 'out.csv', tmp_path / 'scan.json'
+    create_table(database, 95)
+    write_state_file = main.write_state_file
+    saved = []
+
+    def fail_on_fourth_checkpoint(state_file, state):
+        if len(saved) == 3:
+            raise OSError("disk full")
+        write_state_file(state_file, state)
+        saved.append(state)
+
+    monkeypatch.setattr(main, 'write_state_file', fail_on_fourth_checkpoint)
+    assert scan(database, output, checkpoint, key=key) is None
+    assert json.loads(checkpoint.read_text())['last_key'] == 30
+
+    monkeypatch.setattr(main, 'write_state_file', write_state_file)
+    assert scan(database, output, checkpoint, key=key) == 65
+
+    assert exported_names(output) == [f"n{i}" for i in range(95)]
+    assert not checkpoint.exists()
+
+
+def test_checkpoint_on_text_keys(tmp_path, key, monkeypatch):
+    database, output, checkpoint = tmp_path / 'data.db', tmp_path / 'out.csv', tmp_path / 'scan.json'
+    create_table(database, 25)
+    monkeypatch.setattr(main.SqliteBackend, 'scan_key', lambda *args: 'name')
+    states = []
+    monkeypatch.setattr(main, 'write_state_file', lambda state_file, state: states.append(state))
+
+    assert scan(database, output, checkpoint, key=key) == 25
+    assert [state['last_key'] for state in states] == ['n17', 'n4', 'n9']
+
+
+@pytest.mark.parametrize('value, expected', [
+    (42, 42),
+    ('n1', 'n1'),
+    (decimal.Decimal('1.50'), '1.50'),
+    (datetime.datetime(2024, 1, 2, 3, 4, 5), '2024-01-02 03:04:05'),
+    (uuid.UUID(int=1), '00000000-0000-0000-0000-000000000001'),
+])
+def test_watermark_value(value, expected):
+    assert main.watermark_value(value) == expected
+
+
+def test_checkpoint_rejects_binary_keys(tmp_path, key, monkeypatch):
+    database = tmp_path / 'data.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE items (name BLOB)")
+    conn.execute("INSERT INTO items VALUES (x'00ff')")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(main.SqliteBackend, 'scan_key', lambda *args: 'name')
+
+    assert scan(database, tmp_path / 'out.csv', tmp_path / 'scan.json', key=key) is None
+    assert not (tmp_path / 'out.csv').exists()
+
+
+@pytest.mark.parametrize('low, high, partitions, after, expected', [
+    (1, 100, 1, None, [(None, None)]),
+    (1, 100, 4, None, [(None, 25), (25, 50), (50, 75), (75, None)]),
+    (1, 3, 8, None, [(None, 1), (1, 2), (2, None)]),
+    (51, 100, 2, 50, [(50, 75), (75, None)]),
+    ('a', 'z', 4, None, [(None, None)]),
+    (None, None, 4, None, [(None, None)]),
+    (False, True, 4, None, [(None, None)]),
+])
+def test_split_key_range(low, high, partitions, after, expected):
+    assert main.split_key_range(low, high, partitions, after) == expected
+
+
+def incremental(database, tmp_path, key, **options):
+    return main.fetch_data(
+        'sqlite', database=str(database), table='items', incremental=True, state_file=str(tmp_path / 'marks.json'),
+        export='csv', output=str(tmp_path / 'out.csv'), batch_size=10, preview_rows=0, key=key, **options
+    )
+
+
+def add_rows(database, names, created='2024-02-01'):
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO items VALUES (?, ?)", [(name, created) for name in names])
+    conn.commit()
+    conn.close()
+
+
+def test_incremental_export_appends_new_rows(tmp_path, key):
+    database = tmp_path / 'data.db'
+    create_table(database, 25)
+
+    assert incremental(database, tmp_path, key) == 25
+    add_rows(database, ['new1', 'new2'])
+    assert incremental(database, tmp_path, key) == 2
+    assert incremental(database, tmp_path, key) == 0
+
+    assert exported_names(tmp_path / 'out.csv') == [f"n{i}" for i in range(25)] + ['new1', 'new2']
+    marks = json.loads((tmp_path / 'marks.json').read_text())
+    assert marks == {f"sqlite::{database}:items": {'column': 'rowid', 'value': 27}}
+
+
+def test_incremental_mark_only_advances_after_complete_read(tmp_path, key, monkeypatch):
+    database = tmp_path / 'data.db'
+    create_table(database, 25)
+    assert incremental(database, tmp_path, key) == 25
+    add_rows(database, [f"new{i}" for i in range(15)])
+    stream_rows = main.SqliteBackend.stream_rows
+
+    def fail_after_first_batch(*args):
+        rows = stream_rows(*args)
+        yield next(rows)
+        raise OSError("connection lost")
+
+    monkeypatch.setattr(main.SqliteBackend, 'stream_rows', fail_after_first_batch)
+    assert incremental(database, tmp_path, key) is None
+
+    marks = json.loads((tmp_path / 'marks.json').read_text())
+    assert marks[f"sqlite::{database}:items"]['value'] == 25
+
+
+def test_incremental_export_on_watermark_column(tmp_path, key):
+    database = tmp_path / 'data.db'
+    create_table(database, 25)
+
+    assert incremental(database, tmp_path, key, watermark_column='created') == 25
+    add_rows(database, ['late'], created='2024-01-10')
+    add_rows(database, ['new'])
+    assert incremental(database, tmp_path, key, watermark_column='created') == 1
+
+    assert exported_names(tmp_path / 'out.csv')[-1] == 'new'
+    marks = json.loads((tmp_path / 'marks.json').read_text())
+    assert marks[f"sqlite::{database}:items"] == {'column': 'created', 'value': '2024-02-01'}
+
+
+def test_incremental_needs_an_export(tmp_path, key):
+    database = tmp_path / 'data.db'
+    create_table(database, 5)
+
+    rows = main.fetch_data('sqlite', database=str(database), table='items', incremental=True, state_file=str(tmp_path / 'marks.json'), key=key)
+
+    assert rows is None
+    assert not (tmp_path / 'marks.json').exists()
+
+
+def test_incremental_marks_are_kept_per_server(tmp_path, key):
+    database = tmp_path / 'data.db'
+    create_table(database, 5)
+
+    assert incremental(database, tmp_path, key, host='shard1') == 5
+    assert incremental(database, tmp_path, key, host='shard2') == 5
+
+    marks = json.loads((tmp_path / 'marks.json').read_text())
+    assert set(marks) == {f"sqlite:shard1:{database}:items", f"sqlite:shard2:{database}:items"}
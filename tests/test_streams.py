@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+import main
+
+
+def test_parse_copy_row_converts_by_column_type():
+    converters = [main.PG_COPY_CONVERTERS[23], main.PG_COPY_CONVERTERS[17], None, main.PG_COPY_CONVERTERS[16], main.PG_COPY_CONVERTERS[1700]]
+    line = '42\t\\\\x00ff\tline\\none\\ttab\\\\back\tt\t1.50'
+
+    assert main.parse_copy_row(line, converters) == (42, b'\x00\xff', 'line\none\ttab\\back', True, main.Decimal('1.50'))
+
+
+def test_parse_copy_row_reads_null():
+    assert main.parse_copy_row('\\N\t\\N', [int, None]) == (None, None)
+
+
+class FakeCopyCursor:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def copy_expert(self, sql, target):
+        for chunk in self.chunks:
+            target.write(chunk)
+        if self.error:
+            raise self.error
+
+
+def run_copy(stream, cursor):
+    copier = threading.Thread(target=stream.run, args=(cursor, 'COPY'), daemon=True)
+    copier.start()
+    return copier
+
+
+def test_copy_stream_splits_lines_across_chunks():
+    stream = main.CopyStream(chunk_size=4, prefetch=1)
+    copier = run_copy(stream, FakeCopyCursor([b'1\ta\n2', b'\tb\n3\t', b'c']))
+
+    assert list(stream.lines()) == [b'1\ta', b'2\tb', b'3\tc']
+    copier.join(5)
+    assert not copier.is_alive()
+
+
+def test_copy_stream_raises_copy_errors_in_reader():
+    stream = main.CopyStream(chunk_size=4, prefetch=1)
+    copier = run_copy(stream, FakeCopyCursor([b'1\n'], RuntimeError("connection lost")))
+
+    with pytest.raises(RuntimeError, match="connection lost"):
+        list(stream.lines())
+    copier.join(5)
+
+
+def test_copy_stream_stops_copy_when_reader_stops():
+    stream = main.CopyStream(chunk_size=1, prefetch=1)
+    copier = run_copy(stream, FakeCopyCursor(b'%d\n' % i for i in range(10 ** 9)))
+
+    lines = stream.lines()
+    assert next(lines) == b'0'
+    stream.stop()
+    copier.join(5)
+
+    assert not copier.is_alive()